@@ -1,4 +1,5 @@
 from . import *
 from .dawcord import *
 from .audiosource import *
+from .voice import *
 from .utils import *
@@ -1,2 +1,5 @@
 from .pyaudio import *
 from .reastream import *
+from .mixer import *
+from .factory import *
+from .jitter import *
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+from .reastream.source import ReaStreamAudioSource
+from .reastream.receiver import ReaStreamReceiver
+from .pyaudio.source import PyAudioSource
+from .mixer.source import MixerAudioSource
+
+
+def create_audiosource(config):
+    # Build the audio source selected on the configuration file
+    return create_source(config["source"], config)
+
+
+def create_source(source_type, config, overrides=None, receiver=None):
+    # Settings for each source type are read from its "source.<type>" section,
+    # optionally replacing some of them (used for mixer inputs)
+    source_config = _source_config(source_type, config, overrides)
+    # Sources produce frames in the format and length the encoder takes
+    sample_format = config["encoder"].get("sample_format", "s16le")
+    frame_duration = config["encoder"].get("frame_length_ms", 20) / 1000
+
+    if source_type == "reastream":
+        return ReaStreamAudioSource(
+            ipaddr=source_config["ip"],
+            port=source_config["port"],
+            identifier=source_config["identifier"],
+            timeout=source_config.get("timeout", 2.0),
+            resample_quality=source_config["resample_quality"],
+            resample_cpu_budget=source_config.get("resample_cpu_budget", 0.1),
+            resample_cpu_limit=source_config.get("resample_cpu_limit", 0.5),
+            format_crossfade=source_config.get("format_crossfade", 0.005),
+            gain=source_config["gain"],
+            playback_slack=source_config["playback_slack_frames"],
+            max_buffer_frames=source_config["max_buffer_frames"],
+            adaptive_slack=source_config.get("adaptive_slack", False),
+            slack_percentile=source_config.get("slack_percentile", 95.0),
+            slack_window=source_config.get("slack_window", 250),
+            silence_detection=source_config.get("silence_detection", False),
+            silence_threshold=source_config.get("silence_threshold_db", -80),
+            silence_hold=source_config.get("silence_hold", 0.5),
+            reuse_address=source_config.get("reuse_address", False),
+            reuse_port=source_config.get("reuse_port", False),
+            multicast_group=source_config.get("multicast_group"),
+            interface=source_config.get("interface"),
+            sender_timeout=source_config.get("sender_timeout", 1.0),
+            sample_format=sample_format,
+            frame_duration=frame_duration,
+            receiver=receiver,
+        )
+    elif source_type == "pyaudio":
+        return PyAudioSource(
+            device_name=source_config["device_name"],
+            timeout=source_config.get("timeout", 2.0),
+            blocking=source_config.get("blocking", True),
+            gain=source_config["gain"],
+            playback_slack=source_config["playback_slack_frames"],
+            max_buffer_frames=source_config["max_buffer_frames"],
+            adaptive_slack=source_config.get("adaptive_slack", False),
+            slack_percentile=source_config.get("slack_percentile", 95.0),
+            slack_window=source_config.get("slack_window", 250),
+            silence_detection=source_config.get("silence_detection", False),
+            silence_threshold=source_config.get("silence_threshold_db", -80),
+            silence_hold=source_config.get("silence_hold", 0.5),
+            sample_format=sample_format,
+            frame_duration=frame_duration,
+        )
+    elif source_type == "mixer":
+        return _create_mixer(config, source_config, sample_format)
+    raise ValueError(f'Unknown audio source type "{source_type}"')
+
+
+def _source_config(source_type, config, overrides=None):
+    source_config = dict(config[f"source.{source_type}"])
+    if overrides:
+        source_config.update(overrides)
+    return source_config
+
+
+def _reastream_endpoint(source_config):
+    # Address a ReaStream source listens on
+    return (
+        source_config["ip"],
+        source_config["port"],
+        source_config.get("multicast_group"),
+        source_config.get("interface"),
+    )
+
+
+def _create_receiver(source_config):
+    return ReaStreamReceiver(
+        ipaddr=source_config["ip"],
+        port=source_config["port"],
+        timeout=source_config.get("timeout", 2.0),
+        multicast_group=source_config.get("multicast_group"),
+        interface=source_config.get("interface"),
+        reuse_address=source_config.get("reuse_address", False),
+        reuse_port=source_config.get("reuse_port", False),
+    )
+
+
+def _create_mixer(config, mixer_config, sample_format):
+    names = []
+    inputs = []
+    gains = []
+    for i, input_config in enumerate(mixer_config["inputs"]):
+        overrides = dict(input_config)
+        input_type = overrides.pop("source")
+        if input_type == "mixer":
+            raise ValueError("Mixer inputs can't be mixers")
+        names.append(overrides.pop("name", f"{i}:{input_type}"))
+        gains.append(overrides.pop("mix_gain", 0))
+        if input_type == "pyaudio":
+            # Never block the shared mixer clock waiting for a single input
+            overrides["blocking"] = False
+        inputs.append((input_type, overrides))
+
+    # ReaStream inputs on the same address (with different identifiers) share
+    # one socket. Unicast datagrams only reach one of several sockets bound to
+    # the same port, so each input can't have its own.
+    endpoints = Counter(
+        _reastream_endpoint(_source_config(input_type, config, overrides))
+        for input_type, overrides in inputs
+        if input_type == "reastream"
+    )
+    receivers = {}
+    sources = []
+    try:
+        for input_type, overrides in inputs:
+            receiver = None
+            if input_type == "reastream":
+                source_config = _source_config(input_type, config, overrides)
+                endpoint = _reastream_endpoint(source_config)
+                if endpoints[endpoint] > 1:
+                    receiver = receivers.get(endpoint)
+                    if receiver is None:
+                        receiver = _create_receiver(source_config)
+                        receivers[endpoint] = receiver
+            sources.append(create_source(input_type, config, overrides, receiver))
+    except Exception:
+        for source in sources:
+            source.cleanup()
+        for receiver in receivers.values():
+            receiver.close()
+        raise
+
+    return MixerAudioSource(
+        sources,
+        names=names,
+        gains=gains,
+        gain=mixer_config.get("gain", 0),
+        stats_interval=mixer_config.get("stats_interval", 10.0),
+        sample_format=sample_format,
+    )
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+from collections import deque
+from math import ceil
+
+_log = logging.getLogger(__name__)
+
+
+class JitterEstimator:
+    def __init__(
+        self,
+        frame_duration=0.02,
+        percentile=95.0,
+        window=250,
+        min_frames=1,
+        max_frames=8,
+        initial_frames=2,
+        update_interval=1.0,
+        reset_gap=1.0,
+        decrease_hold=5,
+    ):
+        self._frame_duration = frame_duration
+        self._percentile = min(max(float(percentile), 0.0), 100.0)
+        self._min_frames = int(min_frames)
+        self._max_frames = max(int(max_frames), self._min_frames)
+        self._update_interval = update_interval
+        self._reset_gap = reset_gap
+        self._decrease_hold = int(decrease_hold)
+        self._decrease_count = 0
+        # Arrival time minus amount of audio received so far, for each packet.
+        # The spread of these offsets is the delay the buffer must absorb.
+        self._offsets = deque(maxlen=int(window))
+        self._origin = None
+        self._last_arrival = None
+        self._media_time = 0.0
+        self._last_update = 0.0
+        self._jitter = 0.0
+        self._target_frames = min(
+            max(int(initial_frames), self._min_frames), self._max_frames
+        )
+
+    @property
+    def target_frames(self):
+        return self._target_frames
+
+    @property
+    def jitter(self):
+        # Observed arrival jitter (seconds) at the configured percentile
+        return self._jitter
+
+    @property
+    def percentile(self):
+        return self._percentile
+
+    def reset(self):
+        self._offsets.clear()
+        self._origin = None
+        self._last_arrival = None
+        self._media_time = 0.0
+
+    def arrival(self, duration, now=None):
+        # Register a packet carrying `duration` seconds of audio.
+        # Returns True if the target buffer level has changed.
+        if now is None:
+            now = time.perf_counter()
+
+        # Long gaps mean the stream was stopped, don't count them as jitter
+        if (
+            self._last_arrival is not None
+            and now - self._last_arrival > self._reset_gap
+        ):
+            self.reset()
+        if self._origin is None:
+            self._origin = now
+        self._last_arrival = now
+
+        self._offsets.append((now - self._origin) - self._media_time)
+        self._media_time += duration
+
+        if now - self._last_update < self._update_interval:
+            return False
+        self._last_update = now
+        return self._update()
+
+    def _update(self):
+        if len(self._offsets) < 2:
+            return False
+
+        # Delay of each packet relative to the earliest one in the window
+        offsets = sorted(self._offsets)
+        earliest = offsets[0]
+        index = min(
+            len(offsets) - 1, int(round(self._percentile / 100 * (len(offsets) - 1)))
+        )
+        self._jitter = offsets[index] - earliest
+
+        # One extra frame accounts for the frame being consumed by the player
+        target = ceil(self._jitter / self._frame_duration) + 1
+        target = min(max(target, self._min_frames), self._max_frames)
+
+        # Raise immediately to stop dropouts. Lower one frame at a time, and only
+        # after several consecutive updates ask for it, so it does not flap
+        if target < self._target_frames:
+            self._decrease_count += 1
+            if self._decrease_count < self._decrease_hold:
+                return False
+            target = self._target_frames - 1
+        self._decrease_count = 0
+        if target == self._target_frames:
+            return False
+
+        _log.info(
+            f"Adaptive slack: {self._target_frames} -> {target} frames "
+            f"(p{self._percentile:g} jitter {self._jitter * 1000:.1f} ms)"
+        )
+        self._target_frames = target
+        return True
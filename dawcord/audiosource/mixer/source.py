@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import discord
+import time
+import logging
+import contextvars
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from ...conversion.converter import (
+    float_to_s16le,
+    float_to_f32le,
+    db_to_val,
+    val_to_db,
+    SAMPLE_FORMATS,
+)
+
+_log = logging.getLogger(__name__)
+
+
+class MixerAudioSource(discord.AudioSource):
+    def __init__(
+        self,
+        sources,
+        names=None,
+        gains=None,
+        gain=0,
+        stats_interval=10.0,
+        sample_format="s16le",
+    ):
+        if sample_format not in SAMPLE_FORMATS:
+            raise ValueError(f'Unknown sample format "{sample_format}"')
+        # Each read() pulls one frame from every input, so all of them share
+        # the player's clock. Inputs must not block on read().
+        self._sources = list(sources)
+        self._names = (
+            list(names)
+            if names is not None
+            else [str(i) for i in range(len(self._sources))]
+        )
+        if gains is None:
+            gains = [0] * len(self._sources)
+        # Inputs must use the same sample format as the mixer output
+        self._float_output = sample_format == "float"
+        self._dtype = "<f4" if self._float_output else "<i2"
+        # Per-input gain with master gain applied, scaled from s16 to float range
+        scale = 1 if self._float_output else 32767
+        self._gains = np.array(
+            [db_to_val(g + gain) / scale for g in gains], dtype=np.float32
+        )
+        self._is_silent = [getattr(s, "is_silent", None) for s in self._sources]
+        self._stats_interval = stats_interval
+        self._last_stats = time.perf_counter()
+
+    @property
+    def stats(self):
+        return {
+            name: getattr(source, "stats", None)
+            for name, source in zip(self._names, self._sources)
+        }
+
+    def _log_stats(self):
+        for name, stats in self.stats.items():
+            if stats is None:
+                continue
+            _log.info(
+                f"Mixer input {name}: {stats['buffered_frames']:.1f} frames buffered "
+                f"(slack {stats['playback_slack']}), {stats['underruns']} underruns, "
+                f"{stats['overruns']} overruns"
+            )
+
+    def preroll(self, timeout=5.0):
+        # Pre-roll all inputs at the same time
+        sources = [s for s in self._sources if hasattr(s, "preroll")]
+        if not sources:
+            return True
+        # Each one in a copy of the caller context (instance log tags)
+        contexts = [contextvars.copy_context() for _ in sources]
+        with ThreadPoolExecutor(len(sources)) as executor:
+            return all(
+                executor.map(lambda c, s: c.run(s.preroll, timeout), contexts, sources)
+            )
+
+    def read(self):
+        # Stack a frame of each input (16-bit or float stereo) and mix them in one pass
+        frames = b"".join([source.read() for source in self._sources])
+        block = np.frombuffer(frames, dtype=self._dtype).reshape(len(self._sources), -1)
+        if self._float_output:
+            frames = float_to_f32le(self._gains @ block)
+        else:
+            frames, clip = float_to_s16le(self._gains @ block)
+            if clip:
+                _log.warning(f" Mixer clipping! Peak: {val_to_db(clip):.3f} dB")
+
+        if self._stats_interval:
+            now = time.perf_counter()
+            if now - self._last_stats >= self._stats_interval:
+                self._last_stats = now
+                self._log_stats()
+
+        return frames
+
+    def is_opus(self):
+        return False
+
+    def is_silent(self):
+        # Silent only if all inputs are
+        return all(f is not None and f() for f in self._is_silent)
+
+    def cleanup(self):
+        for source in self._sources:
+            source.cleanup()
@@ -2,18 +2,22 @@
 
 import discord
 import logging
+import numpy as np
 import pyaudiowpatch as pya
+import time
 from threading import Lock, Event
-from math import floor
 from ...conversion.converter import (
     silence_16le,
     db_to_val,
+    warmup,
+    SAMPLE_FORMATS,
 )
+from ...conversion.silence import SilenceDetector
+from ..jitter import JitterEstimator
+from ...utils.instance import instance_callback
 
 # See read() method for details
 TARGET_SAMPLE_RATE = 48000
-# Number of samples = Time delay * sample rate * 2 (stereo) * 2 bytes (16-bit PCM)
-TARGET_FRAME_SIZE = floor(discord.player.AudioPlayer.DELAY * TARGET_SAMPLE_RATE * 2 * 2)
 
 _log = logging.getLogger(__name__)
 
@@ -24,22 +28,69 @@ class PyAudioSource(discord.AudioSource):
         self,
         device_name=None,
         timeout=2.0,
+        blocking=True,
         max_buffer_frames=8,
         playback_slack=2,
         gain=0,
+        adaptive_slack=False,
+        slack_percentile=95.0,
+        slack_window=250,
+        silence_detection=False,
+        silence_threshold=-80,
+        silence_hold=0.5,
+        sample_format="s16le",
+        frame_duration=0.02,
     ):
+        if sample_format not in SAMPLE_FORMATS:
+            raise ValueError(f'Unknown sample format "{sample_format}"')
+        # Capture 16-bit PCM, or 32-bit float PCM for the float encoder.
+        # Frame size = Samples per frame * 2 (stereo) * bytes per sample
+        self._float_output = sample_format == "float"
+        self._frame_samples = round(frame_duration * TARGET_SAMPLE_RATE)
+        self._frame_size = self._frame_samples * 2 * SAMPLE_FORMATS[sample_format]
         self._pyaudio = pya.PyAudio()
         self._stream = None
         self._timeout = timeout
+        # Non-blocking reads (mixer inputs) return silence right away while the
+        # buffer fills up, and only give up on it after the timeout
+        self._blocking = blocking
+        self._wait_start = None
         self._gain = db_to_val(gain)
         self._max_buffer_frames = int(max_buffer_frames)
         self._playback_slack = int(playback_slack)
-        self._target_slack_frames = int(TARGET_FRAME_SIZE * self._playback_slack)
+        self._target_slack_frames = int(self._frame_size * self._playback_slack)
+        self._jitter = None
+        if adaptive_slack:
+            # Keep the configured distance between slack and buffer limit,
+            # and use the configured limit as the ceiling for the slack itself
+            self._buffer_headroom = max(
+                self._max_buffer_frames - self._playback_slack, 1
+            )
+            self._jitter = JitterEstimator(
+                frame_duration=frame_duration,
+                percentile=slack_percentile,
+                window=slack_window,
+                max_frames=self._max_buffer_frames,
+                initial_frames=self._playback_slack,
+            )
+        self._silence_detector = None
+        if silence_detection:
+            self._silence_detector = SilenceDetector(
+                silence_threshold,
+                silence_hold,
+                full_scale=1.0 if self._float_output else 32768,
+            )
+        self._silent = False
+        self._silence = silence_16le(self._frame_size >> 1)
         self._buffer = bytearray()
         self._buffer_lock = Lock()
         self._buffer_wait_event = Event()
         self._buffer_waiting = True
         self._buffer_empty = False
+        self._underruns = 0
+        self._overruns = 0
+        self._prerolling = False
+        self._preroll_event = Event()
         self._setup_device(device_name)
 
     def _setup_device(self, device_name):
@@ -64,13 +115,13 @@ class PyAudioSource(discord.AudioSource):
             raise Exception(f'Could not find audio device "{device_name}"')
 
         self._stream = self._pyaudio.open(
-            format=pya.paInt16,
+            format=pya.paFloat32 if self._float_output else pya.paInt16,
             channels=2,
             rate=int(TARGET_SAMPLE_RATE),
-            frames_per_buffer=TARGET_FRAME_SIZE,
+            frames_per_buffer=self._frame_samples,
             input=True,
             input_device_index=input_device_info["index"],
-            stream_callback=self._receive,
+            stream_callback=instance_callback(self._receive),
         )
 
         _log.info(
@@ -78,19 +129,40 @@ class PyAudioSource(discord.AudioSource):
         )
 
     def _receive(self, frames, frame_count, time_info, status):
+        # Measure callback jitter to adjust buffer slack
+        if self._jitter is not None and frame_count > 0:
+            if self._jitter.arrival(frame_count / TARGET_SAMPLE_RATE):
+                self._playback_slack = self._jitter.target_frames
+                self._target_slack_frames = int(self._frame_size * self._playback_slack)
+                self._max_buffer_frames = self._playback_slack + self._buffer_headroom
+
+        # Drop frames while the input is digital silence
+        if self._silence_detector is not None and frame_count > 0:
+            if self._detect_silence(frames, frame_count):
+                return (frames, pya.paContinue)
+
         # Adquire buffer
         self._buffer_lock.acquire()
 
         # If number of frames exceeds limit, clear buffer to refill it with fresh frames.
         # This is not ideal as it introduces clicking, but is camouflaged well enough
         # with discord's opus encoding and keeps latency in check
-        if len(self._buffer) > self._max_buffer_frames * TARGET_FRAME_SIZE:
+        if len(self._buffer) > self._max_buffer_frames * self._frame_size:
             self._buffer.clear()
+            self._overruns += 1
 
         # Append frames to buffer
         if frame_count > 0:
             self._buffer += frames
 
+        # Before playback starts, keep only the newest frames up to the slack level
+        if self._prerolling:
+            excess = len(self._buffer) - self._target_slack_frames
+            if excess > 0:
+                del self._buffer[:excess]
+            if len(self._buffer) >= self._target_slack_frames:
+                self._preroll_event.set()
+
         # Release buffer and notify reading thread data if enough frames are stored
         self._buffer_lock.release()
         if len(self._buffer) >= self._target_slack_frames:
@@ -99,43 +171,123 @@ class PyAudioSource(discord.AudioSource):
 
         return (frames, pya.paContinue)
 
+    def _detect_silence(self, frames, frame_count):
+        was_silent = self._silence_detector.silent
+        silent = self._silence_detector.update(
+            np.frombuffer(frames, dtype="<f4" if self._float_output else "<i2"),
+            frame_count / TARGET_SAMPLE_RATE,
+        )
+        if silent != was_silent:
+            if silent:
+                _log.info("Input is silent, pausing transmission")
+            else:
+                _log.info("Input signal detected, resuming transmission")
+        return silent
+
+    @property
+    def playback_slack(self):
+        return self._playback_slack
+
+    @property
+    def jitter(self):
+        return self._jitter.jitter if self._jitter is not None else None
+
+    @property
+    def stats(self):
+        return {
+            "buffered_frames": len(self._buffer) / self._frame_size,
+            "playback_slack": self._playback_slack,
+            "underruns": self._underruns,
+            "overruns": self._overruns,
+            "jitter": self.jitter,
+        }
+
+    def preroll(self, timeout=5.0):
+        # Warm up the pipeline and fill the buffer up to the slack level, so
+        # playback can start with audio right away. Blocks until filled or timeout.
+        start = time.perf_counter()
+        warmup()
+        self._preroll_event.clear()
+        self._prerolling = True
+        filled = self._preroll_event.wait(timeout)
+        elapsed = (time.perf_counter() - start) * 1000
+        if filled:
+            _log.info(
+                f"Pre-roll done in {elapsed:.0f} ms ({len(self._buffer)}/{self._target_slack_frames})"
+            )
+        else:
+            _log.info(f"Pre-roll timed out after {elapsed:.0f} ms, no audio yet")
+        return filled
+
     def read(self):
         # Discord.py expects 20ms worth of 48kHz 16-bit (2 byte) stereo (2) PCM (0.02*48000*2*2 = 3840 bytes)
+        # With float output, frames hold 32-bit samples instead, so twice as many bytes.
+        # Other frame durations scale the size accordingly (e.g. 10ms -> 1920 bytes).
         # ReaStream may send packets of variable size depending on the DAW's buffer size configuration and latency.
         # It's therefore necessary to buffer the frames to provide a constant output to discord.py's opus encoder.
         #
         # Ideally, a custom encoder implementation with rate/speed control would help to keep latency to a minimum
         # and prevent time "acceleration" glitches when the DAW cannot keep up or ReaStream stops/resumes transmitting.
 
+        # Playback started, stop trimming the buffer to the pre-roll level
+        self._prerolling = False
+
+        # Silent input is not buffered, don't wait for it
+        if (
+            self._silence_detector is not None
+            and self._silence_detector.silent
+            and len(self._buffer) < self._frame_size
+        ):
+            self._silent = True
+            return self._silence
+        self._silent = False
+
         # If not enough frames are available
-        if len(self._buffer) < TARGET_FRAME_SIZE or self._buffer_waiting:
+        if len(self._buffer) < self._frame_size or self._buffer_waiting:
             if not self._buffer_waiting:
                 _log.info(
                     f"Buffer wait ({len(self._buffer)}/{self._target_slack_frames})"
                 )
             # else:
             #     _log.info(
-            #         f"Buffer underrun ({len(self._buffer)}/{TARGET_FRAME_SIZE})"
+            #         f"Buffer underrun ({len(self._buffer)}/{self._frame_size})"
             #     )
             # Wait for buffer to fill up again
-            if not self._buffer_wait_event.wait(timeout=self._timeout):
+            if self._blocking:
+                filled = self._buffer_wait_event.wait(timeout=self._timeout)
+            else:
+                filled = self._buffer_wait_event.is_set()
+                if self._wait_start is None:
+                    self._wait_start = time.perf_counter()
+                if (
+                    not filled
+                    and time.perf_counter() - self._wait_start < self._timeout
+                ):
+                    # Keep the partial data, it's still filling up
+                    return self._silence
+            if not filled:
                 # If timeout exceeded, insert silence
                 if not self._buffer_empty:
                     _log.info(
-                        f"Buffer empty ({len(self._buffer)}/{TARGET_FRAME_SIZE}), inserting silence"
+                        f"Buffer empty ({len(self._buffer)}/{self._frame_size}), inserting silence"
                     )
                     self._buffer_empty = True
+                    self._underruns += 1
                 # Clear buffer to prevent clicks by concatenating old data when the stream is resumed
-                self._buffer = bytearray()
-                return bytes(silence_16le(TARGET_FRAME_SIZE >> 1))
+                self._buffer_lock.acquire()
+                self._buffer.clear()
+                self._buffer_lock.release()
+                self._wait_start = None
+                return self._silence
 
         # When enough frames are available, reset buffer empty message flag and return audio frames
         self._buffer_empty = False
+        self._wait_start = None
         self._buffer_lock.acquire()
         # Return only the target number of frames
-        return_frames = self._buffer[:TARGET_FRAME_SIZE]
+        return_frames = self._buffer[: self._frame_size]
         # The remaining frames are stored to be concatenated on the next function call
-        self._buffer = self._buffer[TARGET_FRAME_SIZE:]
+        self._buffer = self._buffer[self._frame_size :]
         self._buffer_lock.release()
 
         # Reset buffer wait flag
@@ -146,6 +298,10 @@ class PyAudioSource(discord.AudioSource):
     def is_opus(self):
         return False
 
+    def is_silent(self):
+        # True while only padding silence is returned due to silent input
+        return self._silent
+
     def cleanup(self):
         if self._stream is not None:
             self._stream.close()
@@ -1,2 +1,4 @@
 from .packet import *
 from .source import *
+from .network import *
+from .receiver import *
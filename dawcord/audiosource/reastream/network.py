@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import socket
+import struct
+import ipaddress
+
+
+def _parse_interface(interface):
+    # Interfaces can be given either by address or by name (e.g. "eth0").
+    # Returns (address, index), one of them None
+    if interface is None:
+        return None, None
+    try:
+        return ipaddress.ip_address(interface), None
+    except ValueError:
+        pass
+    try:
+        return None, socket.if_nametoindex(interface)
+    except OSError:
+        raise ValueError(f'Unknown network interface "{interface}"')
+
+
+def _unicast_address(ipaddr, address):
+    # Unicast reception is restricted to an interface given by address by
+    # binding to that address, which must agree with the configured one
+    if address is None:
+        return ipaddr
+    try:
+        configured = ipaddress.ip_address(ipaddr)
+    except ValueError:
+        configured = None
+    if configured is not None and (configured.is_unspecified or configured == address):
+        return str(address)
+    raise ValueError(
+        f'Interface address "{address}" does not match the address "{ipaddr}" to listen on'
+    )
+
+
+def _resolve(host, port, family=socket.AF_UNSPEC):
+    # Returns (family, sockaddr) of a numeric or named address, IPv4 or IPv6
+    info = socket.getaddrinfo(host, port, family, socket.SOCK_DGRAM)
+    return info[0][0], info[0][4]
+
+
+def _join_group(sock, family, group, interface):
+    address, index = _parse_interface(interface)
+    if family == socket.AF_INET6:
+        if address is not None:
+            raise ValueError("IPv6 multicast interfaces must be given by name")
+        mreq = struct.pack("16sI", socket.inet_pton(socket.AF_INET6, group), index or 0)
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, mreq)
+    elif index is not None and sys.platform.startswith("linux"):
+        # struct ip_mreqn, selects the interface by index
+        mreq = struct.pack(
+            "4s4si", socket.inet_aton(group), socket.inet_aton("0.0.0.0"), index
+        )
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    elif index is not None and os.name == "nt":
+        # Windows takes an interface index as address 0.0.0.<index> on struct ip_mreq
+        mreq = struct.pack("!4sI", socket.inet_aton(group), index)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    elif index is not None:
+        raise ValueError(
+            "IPv4 multicast interfaces can't be given by name on this platform, "
+            "use the interface address instead"
+        )
+    else:
+        # struct ip_mreq, selects the interface by address (any if not given)
+        mreq = struct.pack(
+            "4s4s",
+            socket.inet_aton(group),
+            socket.inet_aton(str(address) if address is not None else "0.0.0.0"),
+        )
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+
+
+def open_socket(
+    ipaddr,
+    port,
+    timeout=2.0,
+    multicast_group=None,
+    interface=None,
+    reuse_address=False,
+    reuse_port=False,
+):
+    # Opens a UDP socket to receive ReaStream packets. Supports IPv4 and IPv6,
+    # unicast/broadcast on the given address, or joining a multicast group.
+    if multicast_group is not None:
+        family, sockaddr = _resolve(multicast_group, port)
+        if os.name == "nt":
+            # Windows can't bind to a multicast address, use the wildcard instead
+            wildcard = "::" if family == socket.AF_INET6 else "0.0.0.0"
+            family, sockaddr = _resolve(wildcard, port, family)
+    else:
+        address, _ = _parse_interface(interface)
+        family, sockaddr = _resolve(_unicast_address(ipaddr, address), port)
+
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        if reuse_address or multicast_group is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Several receivers share the port, each gets a copy of multicast/broadcast
+            # traffic, unicast packets are balanced between them
+            if not hasattr(socket, "SO_REUSEPORT"):
+                raise OSError("SO_REUSEPORT is not supported on this platform")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        # Restrict reception to a network device given by name. Without
+        # SO_BINDTODEVICE, it can only be applied when joining a multicast group
+        address, index = _parse_interface(interface)
+        if index is not None and hasattr(socket, "SO_BINDTODEVICE"):
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_BINDTODEVICE, interface.encode("ascii")
+            )
+        elif index is not None and multicast_group is None:
+            raise ValueError(
+                "Network interfaces can't be given by name on this platform, "
+                "set ip to the interface address instead"
+            )
+
+        sock.bind(sockaddr)
+
+        if multicast_group is not None:
+            _join_group(sock, family, multicast_group, interface)
+
+        sock.settimeout(timeout)
+    except Exception:
+        sock.close()
+        raise
+    return sock
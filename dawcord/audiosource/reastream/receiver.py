@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from .packet import ReaStreamPacket, ReaStreamAudioPacket, MAX_PACKET_LEN
+from .network import open_socket
+from ...utils.instance import instance_name, instance_callback
+
+_log = logging.getLogger(__name__)
+
+
+class ReaStreamReceiver:
+    # Receives ReaStream packets on a single socket, and hands audio packets to
+    # the handler registered for their identifier. Lets several sources (e.g.
+    # mixer inputs) listen on the same address and port: with unicast, each
+    # datagram is delivered to one socket only, even with address/port reuse.
+    def __init__(
+        self,
+        ipaddr="127.0.0.1",
+        port=58710,
+        timeout=2.0,
+        multicast_group=None,
+        interface=None,
+        reuse_address=False,
+        reuse_port=False,
+    ):
+        self._sock = open_socket(
+            ipaddr,
+            port,
+            timeout=timeout,
+            multicast_group=multicast_group,
+            interface=interface,
+            reuse_address=reuse_address,
+            reuse_port=reuse_port,
+        )
+        self._handlers = {}
+        self._handlers_lock = threading.Lock()
+        self._thread_run = True
+        self._thread = threading.Thread(
+            target=instance_callback(self._thread_func),
+            name=instance_name("dawcord-receive"),
+        )
+        self._thread.start()
+
+    def register(self, identifier, handler):
+        # handler(packet, addr) is called from the receive thread
+        with self._handlers_lock:
+            if identifier in self._handlers:
+                raise ValueError(
+                    f'Identifier "{identifier}" is already received on this address'
+                )
+            self._handlers[identifier] = handler
+
+    def unregister(self, identifier):
+        # The socket is closed once the last handler is gone
+        with self._handlers_lock:
+            self._handlers.pop(identifier, None)
+            if self._handlers:
+                return
+        self.close()
+
+    def close(self):
+        if not self._thread_run:
+            return
+        self._thread_run = False
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._sock.close()
+
+    def _thread_func(self):
+        while self._thread_run:
+            try:
+                data, addr = self._sock.recvfrom(MAX_PACKET_LEN)
+            except TimeoutError:
+                continue
+            packet = ReaStreamPacket.parse_packet(data)
+            if not isinstance(packet, ReaStreamAudioPacket):
+                continue
+            handler = self._handlers.get(packet.identifier)
+            if handler is not None:
+                handler(packet, addr)
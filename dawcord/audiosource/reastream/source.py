@@ -1,28 +1,35 @@
 # -*- coding: utf-8 -*-
 
 import discord
-import socket
+import numpy as np
 import time
 import logging
 import time
 import threading
-from threading import Lock
+from threading import Lock, Event
 from math import gcd
 from .packet import ReaStreamPacket, ReaStreamAudioPacket, MAX_PACKET_LEN
+from .network import open_socket
 from ...conversion.converter import (
     s32_interleave_samples,
     s32_to_float,
     float_to_s16le,
-    mono_to_stereo_16le,
+    float_to_f32le,
+    mono_to_stereo_float,
     silence_16le,
     db_to_val,
     val_to_db,
     float_set_gain,
+    warmup,
+    SAMPLE_FORMATS,
 )
-from ...conversion.resampler import Resampler
+from ...conversion.resampler import ResamplerCache, select_quality, lower_quality
+from ...conversion.crossfade import Crossfade
+from ...conversion.silence import SilenceDetector
+from ..jitter import JitterEstimator
+from ...utils.instance import instance_name, instance_callback
 
 # See read() method for details
-TARGET_FRAME_SIZE = 3840
 TARGET_SAMPLE_RATE = 48000
 
 _log = logging.getLogger(__name__)
@@ -39,28 +46,120 @@ class ReaStreamAudioSource(discord.AudioSource):
         max_buffer_frames=8,
         playback_slack=2,
         gain=0,
+        resample_cpu_budget=0.1,
+        resample_cpu_limit=0.5,
+        format_crossfade=0.005,
+        adaptive_slack=False,
+        slack_percentile=95.0,
+        slack_window=250,
+        silence_detection=False,
+        silence_threshold=-80,
+        silence_hold=0.5,
+        reuse_address=False,
+        reuse_port=False,
+        multicast_group=None,
+        interface=None,
+        sender_timeout=1.0,
+        sample_format="s16le",
+        frame_duration=0.02,
+        receiver=None,
     ):
-        # Receive data via UDP socket
-        self._reasock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        # Bind to address and port
-        self._reasock.bind((ipaddr, port))
-        self._reasock.settimeout(timeout)
+        if sample_format not in SAMPLE_FORMATS:
+            raise ValueError(f'Unknown sample format "{sample_format}"')
+        # Receive data via UDP socket, bound to address and port (or multicast group).
+        # Sources with different identifiers on the same address share a
+        # ReaStreamReceiver instead, which hands them their packets.
+        self._reasock = None
+        self._receiver = receiver
+        if receiver is None:
+            self._reasock = open_socket(
+                ipaddr,
+                port,
+                timeout=timeout,
+                multicast_group=multicast_group,
+                interface=interface,
+                reuse_address=reuse_address,
+                reuse_port=reuse_port,
+            )
         self._identifier = identifier
+        # Streams are told apart by sender address. The first active sender is
+        # locked onto, and others with the same identifier are ignored until it
+        # has been quiet for sender_timeout seconds
+        self._sender = None
+        self._sender_time = 0.0
+        self._sender_timeout = sender_timeout
+        self._ignored_senders = set()
+        self._dropped_packets = 0
         self._resample_quality = resample_quality
+        # With "auto" quality, choose the best quality fitting the CPU budget,
+        # and lower it if processing gets too close to the CPU limit at runtime
+        self._resample_auto = resample_quality == "auto"
+        self._resample_cpu_budget = resample_cpu_budget
+        self._resample_cpu_limit = resample_cpu_limit
+        self._process_load = 0.0
+        self._process_count = 0
         self._gain = db_to_val(gain)
         self._max_buffer_frames = int(max_buffer_frames)
         self._playback_slack = int(playback_slack)
+        self._jitter = None
+        if adaptive_slack:
+            # Keep the configured distance between slack and buffer limit,
+            # and use the configured limit as the ceiling for the slack itself
+            self._buffer_headroom = max(
+                self._max_buffer_frames - self._playback_slack, 1
+            )
+            self._jitter = JitterEstimator(
+                frame_duration=frame_duration,
+                percentile=slack_percentile,
+                window=slack_window,
+                max_frames=self._max_buffer_frames,
+                initial_frames=self._playback_slack,
+            )
+        self._silence_detector = None
+        if silence_detection:
+            self._silence_detector = SilenceDetector(silence_threshold, silence_hold)
+        # Output frames are 16-bit PCM, or 32-bit float PCM for the float encoder,
+        # stereo, and as long as the encoder frames
+        self._float_output = sample_format == "float"
+        self._frame_size = (
+            round(frame_duration * TARGET_SAMPLE_RATE)
+            * 2
+            * SAMPLE_FORMATS[sample_format]
+        )
+        self._silent = False
+        self._silence = silence_16le(self._frame_size >> 1)
         self._buffer = bytearray()
         self._buffer_lock = Lock()
         self._buffer_waiting = False
         self._buffer_empty = False
+        self._buffer_full = False
+        self._prerolling = False
+        self._preroll_event = Event()
+        self._underruns = 0
+        self._overruns = 0
         self._channel_count = 0
         self._sample_rate = 0
         self._resampler = None
+        self._resampler_cache = ResamplerCache(TARGET_SAMPLE_RATE)
         self._resample_min_buffer = 0
+        self._crossfade_length = int(format_crossfade * TARGET_SAMPLE_RATE)
+        self._crossfade = None
+        # End of the output signal, held back from the buffer to fade it out
+        # over the next format after a change
+        self._held = np.zeros(0, dtype=np.float32)
+        # Set when the output signal is interrupted (underrun, silence, sender
+        # switch), so the receive thread starts over from the next packet
+        self._gap = False
         self._receive_thread_run = True
-        self._receive_thread = threading.Thread(target=self._receive_thread_func)
-        self._receive_thread.start()
+        self._receive_thread = None
+        if receiver is not None:
+            receiver.register(self._identifier, self._on_shared_packet)
+        else:
+            self._receive_thread = threading.Thread(
+                target=instance_callback(self._receive_thread_func),
+                name=instance_name("dawcord-receive"),
+            )
+            self._receive_thread.start()
 
     def _on_format_change(self, sample_rate, channel_count):
         _log.info(
@@ -70,17 +169,60 @@ class ReaStreamAudioSource(discord.AudioSource):
         self._channel_count = channel_count
 
         if self._sample_rate != TARGET_SAMPLE_RATE:
-            self._resampler = Resampler(
-                self._sample_rate,
-                TARGET_SAMPLE_RATE,
-                self._channel_count,
-                quality=self._resample_quality,
-            )
+            # With more than 2 channels only the first one is resampled
+            channels = self._channel_count if self._channel_count <= 2 else 1
+            quality = self._resample_quality
+            if self._resample_auto:
+                quality = select_quality(
+                    self._sample_rate,
+                    TARGET_SAMPLE_RATE,
+                    channels,
+                    self._resample_cpu_budget,
+                )
+                _log.info(
+                    f"Resampler quality {quality} selected for {self._sample_rate}Hz {channels}ch"
+                )
+            self._switch_resampler(channels, quality)
+            self._process_load = 0.0
+            self._process_count = 0
             self._resample_min_buffer = gcd(self._sample_rate, TARGET_SAMPLE_RATE)
         else:
-            self._resampler = None
+            self._switch_resampler()
             self._resample_min_buffer = 0
 
+    def _switch_resampler(self, channels=0, quality=None):
+        # Use a resampler for the current sample rate (none without quality)
+        current = self._resampler
+        # The cache would reset the current resampler if it was asked for the
+        # same one again (e.g. mono to 3 channels), keep using it instead
+        keep = (
+            quality is not None
+            and current is not None
+            and (current.in_rate, current.channels, current.quality)
+            == (self._sample_rate, channels, quality)
+        )
+        # Fade out the end of the previous signal over the start of the new one
+        # to avoid clicks: the held back samples, followed by those left in the
+        # current resampler (flushed before the cache can hand it out again)
+        tail = self._held
+        if current is not None and not keep:
+            flushed = float_set_gain(current.flush(), self._gain)
+            if current.channels != 2:
+                flushed = mono_to_stereo_float(flushed)
+            tail = np.concatenate((tail, flushed))
+        # Anything before the crossfade goes out ahead of the new signal
+        split = max(len(tail) - 2 * self._crossfade_length, 0)
+        self._held = tail[:split]
+        if self._crossfade_length > 0:
+            self._crossfade = Crossfade(tail[split:], self._crossfade_length)
+        if keep:
+            return
+        self._resampler = None
+        if quality is not None:
+            self._resampler = self._resampler_cache.get(
+                self._sample_rate, channels, quality
+            )
+
     def _receive(self):
         try:
             data, addr = self._reasock.recvfrom(MAX_PACKET_LEN)
@@ -98,68 +240,128 @@ class ReaStreamAudioSource(discord.AudioSource):
             if packet.identifier != self._identifier:
                 return None
 
-            # Update sample rate and audio channel counters
-            if (
-                self._sample_rate != packet.sample_rate
-                or self._channel_count != packet.channel_count
-            ):
-                self._on_format_change(packet.sample_rate, packet.channel_count)
-
-            return packet.frames
+            return self._accept_packet(packet, addr)
 
         except TimeoutError as e:
             return None
 
-    def _process_frames(self, frames, channel_count):
-        # Convert float PCM multichannel audio to stereo 16 bit little endian.
-        # Also resample audio if source and Discord default sample rates differ.
-        if channel_count == 1:
-            # If number of channels is 1, we need to convert to stereo by doubling samples.
-
-            # Do resampling first if needed on the single channel.
-            frames = s32_to_float(frames)
+    def _accept_packet(self, packet, addr):
+        # Drop packets from other senders using our identifier, before
+        # spending any processing on them
+        if not self._accept_sender(addr):
+            return None
 
-            if self._resampler is not None:
-                frames = self._resampler.resample(frames)
+        # Update sample rate and audio channel counters
+        if (
+            self._sample_rate != packet.sample_rate
+            or self._channel_count != packet.channel_count
+        ):
+            self._on_format_change(packet.sample_rate, packet.channel_count)
 
-            frames = float_set_gain(frames, self._gain)
+        # Measure arrival jitter to adjust buffer slack
+        if self._jitter is not None:
+            self._on_packet_arrival(packet)
 
-            # Do float to 16 bit conversion
-            frames, clip = float_to_s16le(frames)
+        return packet.frames
 
-            # Then duplicate frames for stereo
-            frames = mono_to_stereo_16le(frames)
+    def _accept_sender(self, addr):
+        now = time.perf_counter()
+        if addr != self._sender:
+            if (
+                self._sender is not None
+                and now - self._sender_time < self._sender_timeout
+            ):
+                self._dropped_packets += 1
+                if addr not in self._ignored_senders:
+                    self._ignored_senders.add(addr)
+                    _log.warning(
+                        f'Ignoring sender {addr[0]}:{addr[1]}, identifier "{self._identifier}" is already received from {self._sender[0]}:{self._sender[1]}'
+                    )
+                return False
+            if self._sender is None:
+                _log.info(f"Receiving from sender {addr[0]}:{addr[1]}")
+            else:
+                _log.info(
+                    f"Sender {self._sender[0]}:{self._sender[1]} timed out, switching to {addr[0]}:{addr[1]}"
+                )
+                # Start over with the new stream timing
+                if self._jitter is not None:
+                    self._jitter.reset()
+                self._gap = True
+            self._sender = addr
+            self._ignored_senders.discard(addr)
+        self._sender_time = now
+        return True
+
+    def _on_packet_arrival(self, packet):
+        duration = packet.frames_length / (
+            4 * packet.channel_count * packet.sample_rate
+        )
+        if self._jitter.arrival(duration):
+            self._playback_slack = self._jitter.target_frames
+            self._max_buffer_frames = self._playback_slack + self._buffer_headroom
+
+    @property
+    def playback_slack(self):
+        return self._playback_slack
+
+    @property
+    def jitter(self):
+        return self._jitter.jitter if self._jitter is not None else None
+
+    @property
+    def stats(self):
+        return {
+            "buffered_frames": len(self._buffer) / self._frame_size,
+            "playback_slack": self._playback_slack,
+            "underruns": self._underruns,
+            "overruns": self._overruns,
+            "jitter": self.jitter,
+            "sender": self._sender,
+            "dropped_packets": self._dropped_packets,
+        }
 
-        elif channel_count == 2:
+    def _process_frames(self, frames, channel_count):
+        # Convert float PCM multichannel audio to stereo 16 bit little endian
+        # (or keep it as 32-bit float with float output).
+        # Also resample audio if source and Discord default sample rates differ.
+        if channel_count == 2:
             # For stereo signal we need to interleave samples, as ReaStream packet samples are not interleaved.
-            frames = s32_interleave_samples(frames, 2)
-            frames = s32_to_float(frames)
-
-            # Resample if needed
-            if self._resampler is not None:
-                frames = self._resampler.resample(frames)
-
-            frames = float_set_gain(frames, self._gain)
-
-            # Convert float to s16le
-            frames, clip = float_to_s16le(frames)
+            frames = s32_to_float(s32_interleave_samples(frames, 2))
         else:
             # Number of channels > 2 is not supported, fallback to first channel only and double it.
             # The frames for the first channels are at position 0 until length divided by number of channels
-            frames, clip = s32_to_float(frames[: len(frames) // channel_count])
+            frames = s32_to_float(frames[: len(frames) // channel_count])
+
+        # Resample if needed
+        if self._resampler is not None:
+            frames = self._resampler.resample(frames)
 
-            # Resample if needed
-            if self._resampler is not None:
-                frames = self._resampler.resample(frames)
+        # Set gain (may help prevent clipping)
+        frames = float_set_gain(frames, self._gain)
 
-            # Set gain (may help prevent clipping)
-            frames = float_set_gain(frames, self._gain)
+        # Duplicate mono frames for stereo
+        if channel_count != 2:
+            frames = mono_to_stereo_float(frames)
 
-            # Float to 16 bit conversion
-            frames, clip = float_to_s16le(frames)
+        # Blend with the end of the previous format after a format change
+        if self._crossfade is not None:
+            self._crossfade.apply(frames)
+            if self._crossfade.done:
+                self._crossfade = None
 
-            # Duplicate frames for stereo
-            frames = mono_to_stereo_16le(frames)
+        # Hold back the end of the signal, to fade it out if the format changes
+        frames = np.concatenate((self._held, frames))
+        split = max(len(frames) - 2 * self._crossfade_length, 0)
+        self._held = frames[split:]
+        frames = frames[:split]
+
+        # The float encoder takes samples as they are, no clipping
+        if self._float_output:
+            return float_to_f32le(frames)
+
+        # Float to 16 bit conversion
+        frames, clip = float_to_s16le(frames)
 
         # Print a warning if the conversion had to clip the signal
         if clip:
@@ -167,24 +369,125 @@ class ReaStreamAudioSource(discord.AudioSource):
 
         return frames
 
+    def _detect_silence(self, frames):
+        was_silent = self._silence_detector.silent
+        duration = len(frames) / (4 * self._channel_count * self._sample_rate)
+        silent = self._silence_detector.update(s32_to_float(frames), duration)
+        if silent != was_silent:
+            if silent:
+                _log.info("Input is silent, pausing transmission")
+            else:
+                _log.info("Input signal detected, resuming transmission")
+                # Start from a clean resampler state, old samples are silence anyway
+                if self._resampler is not None:
+                    self._resampler.reset()
+                self._gap = True
+        return silent
+
+    def _check_process_load(self, elapsed, duration):
+        # Smoothed share of real time spent processing packets
+        self._process_load += 0.05 * (elapsed / duration - self._process_load)
+        self._process_count += 1
+        # Wait for enough packets after a quality change before deciding again
+        if self._process_count < 50 or self._process_load <= self._resample_cpu_limit:
+            return
+        quality = lower_quality(self._resampler.quality)
+        if quality is None:
+            return
+        _log.warning(
+            f"Processing uses {self._process_load * 100:.0f}% of real time, "
+            f"lowering resampler quality {self._resampler.quality} -> {quality}"
+        )
+        self._switch_resampler(self._resampler.channels, quality)
+        self._process_load = 0.0
+        self._process_count = 0
+
+    def _check_buffer_full(self):
+        full = len(self._buffer) > self._max_buffer_frames * self._frame_size
+        if full and not self._buffer_full:
+            self._overruns += 1
+        self._buffer_full = full
+        return full
+
     def _receive_thread_func(self):
         while self._receive_thread_run:
             # If number of frames exceeds limit, stop receiving for now.
             # Probably should discard frames to stop latency from slowly creeping up
-            if len(self._buffer) > self._max_buffer_frames * TARGET_FRAME_SIZE:
-                time.sleep((self._sample_rate / TARGET_FRAME_SIZE) / 1000000)
+            if self._check_buffer_full():
+                time.sleep((self._sample_rate / self._frame_size) / 1000000)
                 continue
             frames = self._receive()
             if frames:
-                # Do resampling, bit-depth and channel conversion.
-                frames = self._process_frames(frames, self._channel_count)
-                # From here onwards it's always a 16-bit stereo signal
-                self._buffer_lock.acquire()
-                self._buffer += frames
-                self._buffer_lock.release()
+                self._buffer_frames(frames)
+
+    def _on_shared_packet(self, packet, addr):
+        # Called by a shared receiver thread, which must not block on a single
+        # source: drop packets while the buffer is over the limit
+        if self._check_buffer_full():
+            return
+        frames = self._accept_packet(packet, addr)
+        if frames:
+            self._buffer_frames(frames)
+
+    def _buffer_frames(self, frames):
+        # Skip all processing while the input is digital silence
+        if self._silence_detector is not None and self._detect_silence(frames):
+            return
+        # After a gap, drop the held back samples instead of playing them right
+        # before the new audio, and fade the new audio in
+        if self._gap:
+            self._gap = False
+            self._held = self._held[:0]
+            self._crossfade = None
+            if self._crossfade_length > 0:
+                self._crossfade = Crossfade((), self._crossfade_length)
+        # Do resampling, bit-depth and channel conversion.
+        if self._resample_auto and self._resampler is not None:
+            start = time.perf_counter()
+            duration = len(frames) / (4 * self._channel_count * self._sample_rate)
+            frames = self._process_frames(frames, self._channel_count)
+            self._check_process_load(time.perf_counter() - start, duration)
+        else:
+            frames = self._process_frames(frames, self._channel_count)
+        # From here onwards it's always a 16-bit (or float) stereo signal
+        self._buffer_lock.acquire()
+        # Unless read() ran dry meanwhile: start over from the next packet then
+        if not self._gap:
+            self._buffer += frames
+        if self._prerolling:
+            self._trim_preroll()
+        self._buffer_lock.release()
+
+    def _trim_preroll(self):
+        # Before playback starts, keep only the newest frames up to the slack level
+        slack_frames = self._frame_size * self._playback_slack
+        excess = len(self._buffer) - slack_frames
+        if excess > 0:
+            del self._buffer[:excess]
+        if len(self._buffer) >= slack_frames:
+            self._preroll_event.set()
+
+    def preroll(self, timeout=5.0):
+        # Warm up the pipeline and fill the buffer up to the slack level, so
+        # playback can start with audio right away. Blocks until filled or timeout.
+        start = time.perf_counter()
+        warmup()
+        self._preroll_event.clear()
+        self._prerolling = True
+        filled = self._preroll_event.wait(timeout)
+        elapsed = (time.perf_counter() - start) * 1000
+        if filled:
+            _log.info(
+                f"Pre-roll done in {elapsed:.0f} ms ({len(self._buffer)}/{self._frame_size * self._playback_slack})"
+            )
+        else:
+            _log.info(f"Pre-roll timed out after {elapsed:.0f} ms, no audio yet")
+        return filled
 
     def read(self):
         # Discord.py expects 20ms worth of 48kHz 16-bit (2 byte) stereo (2) PCM (0.02*48000*2*2 = 3840 bytes)
+        # With float output, frames hold 32-bit samples instead, so twice as many bytes.
+        # Other frame durations scale the size accordingly (e.g. 10ms -> 1920 bytes).
         # ReaStream may send packets of variable size depending on the DAW's buffer size configuration and latency.
         # It's therefore necessary to buffer the frames to provide a constant output to discord.py's opus encoder.
         #
@@ -192,7 +495,7 @@ class ReaStreamAudioSource(discord.AudioSource):
         # and prevent time "acceleration" glitches when the DAW cannot keep up or ReaStream stops/resumes transmitting.
 
         # # Buffer until target size
-        # while len(self._buffer) < TARGET_FRAME_SIZE:
+        # while len(self._buffer) < self._frame_size:
         #     # Receive packet
         #     frames = self._receive()
         #     if frames:
@@ -202,49 +505,69 @@ class ReaStreamAudioSource(discord.AudioSource):
         #         self._buffer += frames
 
         # # Return only the target number of frames
-        # return_frames = self._buffer[:TARGET_FRAME_SIZE]
+        # return_frames = self._buffer[:self._frame_size]
         # # The remaining frames are stored to be concatenated on the next function call
-        # self._buffer = self._buffer[TARGET_FRAME_SIZE:]
-        # print(f"{len(return_frames)}:{len(silence_16le(TARGET_FRAME_SIZE >> 1))}")
+        # self._buffer = self._buffer[self._frame_size:]
+        # print(f"{len(return_frames)}:{len(silence_16le(self._frame_size >> 1))}")
         # return bytes(return_frames)
 
-        if len(self._buffer) >= TARGET_FRAME_SIZE:
+        # Playback started, stop trimming the buffer to the pre-roll level
+        self._prerolling = False
+
+        if len(self._buffer) >= self._frame_size:
             # If we just had an empty buffer, wait to build up slack
-            slack_frames = TARGET_FRAME_SIZE * self._playback_slack
+            slack_frames = self._frame_size * self._playback_slack
             if self._buffer_empty and len(self._buffer) < slack_frames:
                 if not self._buffer_waiting:
                     _log.info(
                         f"Building buffer slack: {len(self._buffer)}/{slack_frames}"
                     )
                     self._buffer_waiting = True
-                return bytes(silence_16le(TARGET_FRAME_SIZE >> 1))
+                return self._silence
             else:
                 self._buffer_waiting = False
 
             # Otherwise, reset buffer status and return audio frames
             self._buffer_empty = False
+            self._silent = False
             self._buffer_lock.acquire()
             # Return only the target number of frames
-            return_frames = self._buffer[:TARGET_FRAME_SIZE]
+            return_frames = self._buffer[: self._frame_size]
             # The remaining frames are stored to be concatenated on the next function call
-            self._buffer = self._buffer[TARGET_FRAME_SIZE:]
+            self._buffer = self._buffer[self._frame_size :]
             self._buffer_lock.release()
             # print(f"Play position: {len(self._buffer)/len(return_frames):.2f}")
             return bytes(return_frames)
         else:
+            # Buffer ran dry because the input is silent, no need to warn
+            self._silent = (
+                self._silence_detector is not None and self._silence_detector.silent
+            )
             if not self._buffer_empty:
-                _log.info(
-                    f"Buffer empty ({len(self._buffer)}/{TARGET_FRAME_SIZE}), inserting silence"
-                )
+                if not self._silent:
+                    _log.info(
+                        f"Buffer empty ({len(self._buffer)}/{self._frame_size}), inserting silence"
+                    )
+                    self._underruns += 1
                 self._buffer_empty = True
                 # Clear buffer to prevent clicks when the stream is resumed
+                self._buffer_lock.acquire()
                 self._buffer = bytearray()
-            return bytes(silence_16le(TARGET_FRAME_SIZE >> 1))
+                self._gap = True
+                self._buffer_lock.release()
+            return self._silence
 
     def is_opus(self):
         return False
 
+    def is_silent(self):
+        # True while only padding silence is returned due to silent input
+        return self._silent
+
     def cleanup(self):
+        if self._receiver is not None:
+            self._receiver.unregister(self._identifier)
+            return
         self._receive_thread_run = False
         self._receive_thread.join()
         self._reasock.close()
@@ -2,11 +2,22 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import asyncio
+import logging
 import os
 import sys
+import time
 import discord
+from pathlib import Path
 from .utils.settings import load_settings
+from .utils.profiler import Profiler, install_stages, instrument_source
+from .utils.instance import current_instance, tag_instance_logs
 from .dawcord import DawCord
+from .audiosource.factory import create_audiosource
+from .voice.encoder import create_encoder
+from .voice.sink import HeadlessSink
+
+_log = logging.getLogger(__name__)
 
 
 def run():
@@ -17,14 +28,15 @@ def run():
         "channelID",
         metavar="channelID",
         type=int,
-        help="Discord channel ID to send audio to",
+        nargs="?",
+        help='Discord channel ID to send audio to (default: "channel" on the config file, not needed with --headless)',
     )
     parser.add_argument(
         "--config",
         metavar="<path>",
-        dest="config",
-        default="config.json",
-        help="Config file location (default 'config.json')",
+        dest="configs",
+        action="append",
+        help="Config file location (default 'config.json'). Repeat it to run several bots in the same process, each one sending to the \"channel\" on its config file",
     )
     parser.add_argument(
         "--token",
@@ -33,47 +45,199 @@ def run():
         default=None,
         help="Discord API token",
     )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        help="Time each stage of the audio path, and write a report on exit",
+    )
+    parser.add_argument(
+        "--profile-sample-rate",
+        metavar="<hz>",
+        dest="profile_sample_rate",
+        type=int,
+        default=0,
+        help="Also sample receive and player thread stacks at this rate (default 0, disabled)",
+    )
+    parser.add_argument(
+        "--profile-output",
+        metavar="<prefix>",
+        dest="profile_output",
+        default="dawcord-profile",
+        help="Profile report files prefix, writes <prefix>.txt and <prefix>.folded (default 'dawcord-profile')",
+    )
+    parser.add_argument(
+        "--headless",
+        dest="headless",
+        action="store_true",
+        help="Run the audio pipeline and encoder locally, without connecting to Discord",
+    )
+    parser.add_argument(
+        "--headless-output",
+        metavar="<path>",
+        dest="headless_output",
+        default=None,
+        help="Write headless output to this file (default: discard)",
+    )
+    parser.add_argument(
+        "--headless-format",
+        dest="headless_format",
+        choices=("pcm", "opus"),
+        default="pcm",
+        help="Headless output format: raw PCM, or 16-bit length prefixed Opus packets (default 'pcm')",
+    )
+    parser.add_argument(
+        "--headless-duration",
+        metavar="<seconds>",
+        dest="headless_duration",
+        type=float,
+        default=None,
+        help="Stop headless run after this many seconds (default: run until Control+C)",
+    )
     args = parser.parse_args()
 
-    # Load/create settings file
-    config = load_settings(args.config)
-    if config is None:
-        print(
-            f'Generated configuration file "{args.config}" in current directory.\nPlease fill in your bot token before running again.'
-        )
+    # Load/create settings files
+    config_paths = args.configs or ["config.json"]
+    configs = []
+    for config_path in config_paths:
+        config = load_settings(config_path)
+        if config is None:
+            print(
+                f'Generated configuration file "{config_path}" in current directory.\nPlease fill in your bot token before running again.'
+            )
+        configs.append(config)
+    if None in configs:
         return
 
-    # Fetch Discord API token
-    env_token = os.environ.get("TOKEN")
-    if args.token is not None:
-        # Retrieve token from args if available
-        token = args.token
-    elif env_token is not None:
-        # Otherwise, try from environment variable
-        token = env_token
-    else:
-        # Finally, fallback to config file
-        token = config.get("token")
-    if token is None:
-        print(
-            "Could not read Discord API token neither from environment variable, nor arguments, nor config file",
-            file=sys.stderr,
-        )
+    if args.headless:
+        if len(configs) > 1:
+            parser.error("--headless takes a single --config file")
+        run_headless(configs[0], args)
         return
 
+    if len(configs) > 1 and args.channelID is not None:
+        parser.error(
+            'channelID can\'t be used with several --config files, set "channel" on each one instead'
+        )
+
     # Setup global logging
     discord.utils.setup_logging(root=True)
+    if len(configs) > 1:
+        # Tell apart the logs of each bot
+        tag_instance_logs()
 
-    # Configure and run bot
-    bot = DawCord(
-        intents=discord.Intents.default(),
-        command_prefix="%",
-        channelid=int(args.channelID),
-        config=config,
-    )
+    # Configure bots
+    instances = []
+    for config_path, config in zip(config_paths, configs):
+        channel = (
+            args.channelID if args.channelID is not None else config.get("channel")
+        )
+        if channel is None:
+            parser.error(
+                f'the following arguments are required: channelID (or "channel" on {config_path})'
+            )
+        token = read_token(args, config, prefer_config=len(configs) > 1)
+        if token is None:
+            print(
+                f"Could not read Discord API token for {config_path} neither from environment variable, nor arguments, nor config file",
+                file=sys.stderr,
+            )
+            return
+        bot = DawCord(
+            intents=discord.Intents.default(),
+            command_prefix="%",
+            channelid=int(channel),
+            config=config,
+        )
+        # Instances are named after their config file, unless set on it
+        name = config.get("name") or Path(config_path).stem
+        instances.append((name if len(configs) > 1 else None, bot, token))
+
+    # Run all bots on the same event loop
+    profiler = start_profiler(args)
+    try:
+        asyncio.run(run_instances(instances))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(args.profile_output)
 
-    # Run with token, and disable log handler (already configured root logger above)
-    bot.run(token, log_handler=None)
+
+def read_token(args, config, prefer_config=False):
+    # Fetch Discord API token from arguments, environment variable or config file,
+    # in that order. With several bots each config file names its own account,
+    # so it goes first.
+    sources = [args.token, os.environ.get("TOKEN")]
+    if prefer_config:
+        sources.insert(0, config.get("token") or None)
+    else:
+        sources.append(config.get("token"))
+    for token in sources:
+        if token is not None:
+            return token
+    return None
+
+
+async def run_instances(instances):
+    # One process and event loop for all bots, so audio modules, the opus
+    # library and resampler benchmarks are loaded once and shared
+    await asyncio.gather(*(run_instance(*instance) for instance in instances))
+
+
+async def run_instance(name, bot, token):
+    # Tasks started by the bot inherit the instance name, to tag their logs
+    if name is not None:
+        current_instance.set(name)
+    try:
+        async with bot:
+            await bot.start(token)
+    except Exception:
+        # Don't bring down the other bots
+        _log.exception("Bot stopped with an error")
+
+
+def start_profiler(args):
+    # Only instrument the audio path when requested, otherwise it runs untouched
+    if not args.profile:
+        return None
+    profiler = Profiler(sample_rate=args.profile_sample_rate)
+    install_stages(profiler)
+    profiler.start()
+    return profiler
+
+
+def run_headless(config, args):
+    # Drive the configured source and encoder without a voice connection
+    discord.utils.setup_logging(root=True)
+    profiler = start_profiler(args)
+    try:
+        started = time.perf_counter()
+        # Encoder first, so a missing opus library fails before any thread starts
+        encoder = create_encoder(config["encoder"])
+        source = create_audiosource(config)
+        try:
+            if profiler is not None:
+                instrument_source(profiler, source)
+            if hasattr(source, "preroll"):
+                source.preroll(config.get("preroll_timeout", 5.0))
+            sink = HeadlessSink(
+                source,
+                encoder,
+                output=args.headless_output,
+                output_format=args.headless_format,
+                started=started,
+            )
+            sink.run(duration=args.headless_duration)
+        finally:
+            source.cleanup()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(args.profile_output)
 
 
 if __name__ == "__main__":
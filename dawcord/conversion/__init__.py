@@ -1,2 +1,4 @@
 from .converter import *
 from .resampler import *
+from .silence import *
+from .crossfade import *
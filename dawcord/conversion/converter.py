@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
-import array
-import struct
 import math
+import numpy as np
+from functools import lru_cache
+
+# Bytes per sample of each output format handed to the encoder
+SAMPLE_FORMATS = {"s16le": 2, "float": 4}
 
 
 def db_to_val(db):
@@ -14,66 +17,71 @@ def val_to_db(val):
 
 
 def float_set_gain(frames, gain):
-    return [sample * gain for sample in frames]
+    return np.asarray(frames, dtype=np.float32) * np.float32(gain)
 
 
 def s32_interleave_samples(frame_chunk, channels):
     # Not tested for channel numbers > 2
-    # For interleaved order, each frame contains a sample from each channel sequentially
-    stride = len(frame_chunk) // channels
-    interleaved_frames = bytearray()
-    # Iterate over each float value
-    for x in range(0, stride, 4):
-        # For each channel,
-        for ch in range(0, channels):
-            # Jump a fixed stride to get next sample
-            pos = stride * ch + x
-            interleaved_frames += frame_chunk[pos : pos + 4]
-    return interleaved_frames
+    # For interleaved order, each frame contains a sample from each channel sequentially.
+    # Non-interleaved frames are stored one channel after another, so a transpose does the job.
+    planar = np.frombuffer(frame_chunk, dtype="<f4").reshape(channels, -1)
+    return planar.T.tobytes()
 
 
 def s32_to_float(frames):
-    return [sample for sample in array.array("f", frames)]
+    # Zero-copy view of 32-bit float PCM
+    return np.frombuffer(frames, dtype="<f4")
 
 
 def float_to_s16le(frames):
-    # Converts python float to s16le (16 bit "CD quality" PCM)
-    # with hard clipping if signal exceeds maximum values
-    out_frames = bytearray()
-    # clip = False
+    # Converts float samples to s16le (16 bit "CD quality" PCM)
+    # with hard clipping if signal exceeds maximum values.
+    # Returns the peak value if the signal was clipped, 0 otherwise
+    frames = np.asarray(frames, dtype=np.float32)
     clip = 0
-    for sample in frames:
-        reduced_sample = sample * 32767
-        if reduced_sample > 32767 or reduced_sample < -32768:
-            # clip = True
-            clip = max(clip, sample)
-        hard_clip_sample = int(min(max(reduced_sample, -32768), 32767))
-        out_frames += struct.pack("<h", hard_clip_sample)
-    return bytes(out_frames), clip
+    if frames.size:
+        peak = float(np.max(np.abs(frames)))
+        if peak > 1:
+            clip = peak
+    out_frames = np.clip(frames * 32767, -32768, 32767).astype("<i2")
+    return out_frames.tobytes(), clip
+
+
+def float_to_f32le(frames):
+    # Packs float samples as 32-bit float PCM, for the float Opus encoder.
+    # No clipping, values over full scale are left for the encoder to handle
+    return np.asarray(frames, dtype="<f4").tobytes()
 
 
 def s32_to_s16le(frames):
     # Converts s32 (32-bit float) to s16le (16 bit "CD quality" PCM)
     # with hard clipping if signal exceeds maximum values
-    out_frames = bytearray()
-    clip = False
-    for sample in array.array("f", frames):
-        reduced_sample = sample * 32767
-        if reduced_sample > 32767 or reduced_sample < -32768:
-            clip = True
-        hard_clip_sample = int(min(max(reduced_sample, -32768), 32767))
-        out_frames += struct.pack("<h", hard_clip_sample)
-    return bytes(out_frames), clip
+    out_frames, clip = float_to_s16le(s32_to_float(frames))
+    return out_frames, bool(clip)
 
 
 def mono_to_stereo_16le(frames):
     # Converts s16le mono to interleaved stereo by doubling each sample
-    out_frames = bytearray()
-    for sample in array.array("h", frames):
-        out_frames += struct.pack("<hh", sample, sample)
-    return bytes(out_frames)
+    return np.repeat(np.frombuffer(frames, dtype="<i2"), 2).tobytes()
+
+
+def mono_to_stereo_float(frames):
+    # Converts float mono to interleaved stereo by doubling each sample
+    return np.repeat(np.asarray(frames, dtype=np.float32), 2)
 
 
+@lru_cache(maxsize=8)
 def silence_16le(count):
-    # Returns silent 16-bit audio frames
-    return bytes(struct.pack("<h", 0) * count)
+    # Returns silent 16-bit audio frames (all zeros, so half as many 32-bit
+    # float frames are silent too).
+    # Cached, the same (immutable) buffer is returned for each frame count
+    return bytes(2 * count)
+
+
+def warmup():
+    # Run each conversion once, so the first real packets don't pay for
+    # first-call setup (allocations, lazy imports, caches)
+    frames = bytes(4 * 2 * 64)
+    float_to_s16le(float_set_gain(s32_to_float(s32_interleave_samples(frames, 2)), 1))
+    float_to_f32le(s32_to_float(frames))
+    mono_to_stereo_16le(bytes(2 * 64))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class Crossfade:
+    # Fades in a new stereo float signal over `length` samples, while fading out
+    # the tail of the previous one on top of it
+    def __init__(self, tail, length):
+        self._length = int(length)
+        self._pos = 0
+        tail = np.asarray(tail, dtype=np.float32).reshape(-1, 2)[: self._length]
+        self._tail = np.zeros((self._length, 2), dtype=np.float32)
+        self._tail[: len(tail)] = tail
+        ramp = np.arange(1, self._length + 1, dtype=np.float32) / (self._length + 1)
+        self._fade_in = ramp[:, None]
+        self._fade_out = 1 - self._fade_in
+
+    @property
+    def done(self):
+        return self._pos >= self._length
+
+    def apply(self, frames):
+        # Applies the crossfade in place to interleaved stereo float frames,
+        # continuing where the previous call left off
+        count = min(self._length - self._pos, len(frames) // 2)
+        if count > 0:
+            head = frames[: 2 * count].reshape(-1, 2)
+            window = slice(self._pos, self._pos + count)
+            head *= self._fade_in[window]
+            head += self._tail[window] * self._fade_out[window]
+            self._pos += count
+        return frames
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 
 import soxr
+import time
 import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
+
+# Resampling qualities supported by soxr, best first
+QUALITIES = ("VHQ", "HQ", "MQ", "LQ", "QQ")
 
 
 class Resampler:
     def __init__(self, in_rate, out_rate, channels, quality="HQ"):
+        self.in_rate = in_rate
+        self.quality = quality
+        self.channels = channels
         self._resampler = soxr.ResampleStream(
             in_rate, out_rate, channels, dtype="float32", quality=quality
         )
@@ -16,12 +25,76 @@ class Resampler:
     def resample(self, frames):
         return self._resample_func(frames)
 
+    def reset(self):
+        # Drop buffered samples, ready for a new signal with the same format
+        self._resampler.clear()
+
+    def flush(self):
+        # Returns the samples still held by the filter at the end of a signal.
+        # Must be reset before resampling again.
+        shape = (0, self.channels) if self.channels > 1 else (0,)
+        res = self._resampler.resample_chunk(
+            np.zeros(shape, dtype=np.float32), last=True
+        )
+        return np.ravel(res, order="C")
+
     def _resample(self, frames):
-        src = np.asarray(frames).astype(np.float32)
+        src = np.asarray(frames, dtype=np.float32)
         return self._resampler.resample_chunk(src, last=False)
 
     def _resample_stereo(self, frames):
-        src = np.asarray(frames).astype(np.float32)
-        src = np.vstack((src[::2], src[1::2])).T
+        src = np.asarray(frames, dtype=np.float32).reshape(-1, 2)
         res = self._resampler.resample_chunk(src, last=False)
-        return np.ravel(res, order="C").tolist()
+        return np.ravel(res, order="C")
+
+
+class ResamplerCache:
+    # Keeps the most recently used resamplers, so switching back and forth
+    # between formats doesn't build new soxr streams every time
+    def __init__(self, out_rate, size=4):
+        self._out_rate = out_rate
+        self._size = size
+        self._cache = OrderedDict()
+
+    def get(self, in_rate, channels, quality):
+        key = (in_rate, channels, quality)
+        resampler = self._cache.pop(key, None)
+        if resampler is None:
+            resampler = Resampler(in_rate, self._out_rate, channels, quality=quality)
+        else:
+            resampler.reset()
+        self._cache[key] = resampler
+        while len(self._cache) > self._size:
+            self._cache.popitem(last=False)
+        return resampler
+
+
+def benchmark(in_rate, out_rate, channels, quality, block=1024, blocks=20):
+    # Returns the share of real time spent resampling blocks of noise
+    resampler = soxr.ResampleStream(
+        in_rate, out_rate, channels, dtype="float32", quality=quality
+    )
+    shape = (block, channels) if channels > 1 else (block,)
+    src = np.random.default_rng(0).uniform(-1, 1, shape).astype(np.float32)
+    # First block allocates the filters, don't count it
+    resampler.resample_chunk(src, last=False)
+    start = time.perf_counter()
+    for _ in range(blocks):
+        resampler.resample_chunk(src, last=False)
+    elapsed = time.perf_counter() - start
+    return elapsed / (blocks * block / in_rate)
+
+
+@lru_cache(maxsize=16)
+def select_quality(in_rate, out_rate, channels, cpu_budget=0.1):
+    # Highest quality whose processing time fits in the given share of real time
+    for quality in QUALITIES:
+        if benchmark(in_rate, out_rate, channels, quality) <= cpu_budget:
+            return quality
+    return QUALITIES[-1]
+
+
+def lower_quality(quality):
+    # Next quality below the given one, None if it is already the lowest
+    index = QUALITIES.index(quality)
+    return QUALITIES[index + 1] if index + 1 < len(QUALITIES) else None
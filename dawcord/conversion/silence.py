@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from .converter import db_to_val
+
+
+class SilenceDetector:
+    def __init__(self, threshold=-80, hold=0.5, full_scale=1.0):
+        # Threshold in dBFS, relative to the full scale value of the samples
+        # (1.0 for float, 32768 for 16-bit integer samples)
+        self._threshold = db_to_val(threshold) * full_scale
+        self._hold = hold
+        self._silent_time = 0.0
+
+    @property
+    def silent(self):
+        # True once the signal has been below threshold for the hold time
+        return self._silent_time >= self._hold
+
+    def update(self, samples, duration):
+        # Registers a block of samples (numpy array) spanning `duration` seconds.
+        # Returns True if the input is in a long silence
+        if samples.size and np.max(np.abs(samples)) > self._threshold:
+            self._silent_time = 0.0
+        else:
+            self._silent_time += duration
+        return self._silent_time >= self._hold
+
+    def reset(self):
+        self._silent_time = 0.0
@@ -3,9 +3,14 @@
 import discord
 from discord.ext import commands
 import sys
+import time
+import asyncio
 import logging
-from .audiosource.reastream.source import ReaStreamAudioSource
-from .audiosource.pyaudio.source import PyAudioSource
+from .audiosource.factory import create_audiosource
+from .voice.encoder import create_encoder
+from .voice.player import play
+from .voice.controller import BitrateController
+from .utils.profiler import active_profiler, instrument_source
 
 _log = logging.getLogger(__name__)
 
@@ -48,9 +53,11 @@ class DawCord(commands.Bot):
         self._playback_slack = playback_slack
         self._max_buffer_frames = max_buffer_frames
         self.voiceclient = None
+        self.controller = None
 
     async def on_ready(self):
         _log.info(f"Logged in as {self.user} (ID: {self.user.id})")
+        started = time.perf_counter()
         try:
             # Get channel ID
             self.channel = self.get_channel(self._channelid)
@@ -69,27 +76,15 @@ class DawCord(commands.Bot):
                 await self.close()
                 return
 
-            # Setup audio source from configuration file
+            # Setup encoder and audio source from configuration file, before
+            # connecting, so none of it delays playback once connected
             try:
-                if self._config["source"] == "reastream":
-                    source_config = self._config["source.reastream"]
-                    self.audiosource = ReaStreamAudioSource(
-                        ipaddr=source_config["ip"],
-                        port=source_config["port"],
-                        identifier=source_config["identifier"],
-                        resample_quality=source_config["resample_quality"],
-                        gain=source_config["gain"],
-                        playback_slack=source_config["playback_slack_frames"],
-                        max_buffer_frames=source_config["max_buffer_frames"],
-                    )
-                elif self._config["source"] == "pyaudio":
-                    source_config = self._config["source.pyaudio"]
-                    self.audiosource = PyAudioSource(
-                        device_name=source_config["device_name"],
-                        gain=source_config["gain"],
-                        playback_slack=source_config["playback_slack_frames"],
-                        max_buffer_frames=source_config["max_buffer_frames"],
-                    )
+                encoder_config = self._config["encoder"]
+                encoder = create_encoder(encoder_config)
+                encoder.warmup()
+                self.audiosource = create_audiosource(self._config)
+                if active_profiler() is not None:
+                    instrument_source(active_profiler(), self.audiosource)
             except KeyError as e:
                 _log.error(
                     "Could not find configuration key: " + e.messsage
@@ -97,8 +92,18 @@ class DawCord(commands.Bot):
                     else str(e)
                 )
 
-            # Connect to voicechannel
-            self.voiceclient = await self.channel.connect()
+            # Connect to voicechannel, while the audio pipeline warms up and fills
+            # its buffer. Playback can then start with audio right away.
+            preroll = getattr(self.audiosource, "preroll", None)
+            if preroll is not None:
+                self.voiceclient, _ = await asyncio.gather(
+                    self.channel.connect(),
+                    asyncio.to_thread(
+                        preroll, self._config.get("preroll_timeout", 5.0)
+                    ),
+                )
+            else:
+                self.voiceclient = await self.channel.connect()
             _log.info(f"Connected to {self._channelid}")
 
             # Set bot as "deaf", not receiving audio/listening to other users
@@ -108,17 +113,28 @@ class DawCord(commands.Bot):
 
             # Start audio transmission
             try:
-                encoder_config = self._config["encoder"]
-                self.voiceclient.play(
-                    self.audiosource,
-                    application=encoder_config["application"],
-                    bitrate=encoder_config["bitrate"],
-                    fec=encoder_config["fec"],
-                    expected_packet_loss=encoder_config["expected_packet_loss"],
-                    bandwidth=encoder_config["bandwidth"],
-                    signal_type=encoder_config["signal_type"],
+                player = play(
+                    self.voiceclient, self.audiosource, encoder, started=started
                 )
                 _log.info("Audio sink is alive")
+
+                # Adjust encoder settings to network conditions
+                adaptive_config = self._config.get("encoder.adaptive", {})
+                if adaptive_config.get("enabled", False):
+                    self.controller = BitrateController(
+                        self.voiceclient,
+                        encoder,
+                        player,
+                        min_bitrate=adaptive_config["min_bitrate"],
+                        max_bitrate=adaptive_config["max_bitrate"],
+                        fec=encoder_config["fec"],
+                        min_packet_loss=adaptive_config["min_packet_loss"],
+                        max_packet_loss=adaptive_config["max_packet_loss"],
+                        rtt_threshold=adaptive_config["rtt_threshold"],
+                        lateness_threshold=adaptive_config["lateness_threshold"],
+                        interval=adaptive_config["interval"],
+                    )
+                    self.controller.start()
             except KeyError as e:
                 _log.error(
                     "Could not find configuration key: " + e.messsage
@@ -144,6 +160,8 @@ class DawCord(commands.Bot):
 
     async def close(self):
         _log.info("Disconnecting...")
+        if self.controller:
+            self.controller.stop()
         if self.voiceclient:
             # Disconnect voice
             await self.voiceclient.disconnect()
@@ -1 +1,3 @@
 from .settings import *
+from .profiler import *
+from .instance import *
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import contextvars
+
+# Name of the DawCord instance the running code belongs to, when several run
+# in the same process. Tasks inherit it, threads and callbacks keep it when
+# wrapped with instance_callback().
+current_instance = contextvars.ContextVar("dawcord_instance", default=None)
+
+
+def instance_name(base):
+    # Tags a name (threads, profiler stages) with the current instance
+    instance = current_instance.get()
+    return f"{base}[{instance}]" if instance is not None else base
+
+
+def instance_callback(func):
+    # Wraps a function run on another thread (thread targets, PortAudio
+    # callbacks) to run in the current instance context
+    context = contextvars.copy_context()
+    return lambda *args: context.run(func, *args)
+
+
+class InstanceLogFilter(logging.Filter):
+    # Prefixes log messages with the name of the instance they come from
+    def filter(self, record):
+        instance = current_instance.get()
+        # Records are shared by all handlers, only tag them once
+        if instance is not None and not hasattr(record, "instance"):
+            record.instance = instance
+            record.msg = f"[{instance}] {record.msg}"
+        return True
+
+
+def tag_instance_logs():
+    # Add instance tags to the messages of all root log handlers
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(InstanceLogFilter())
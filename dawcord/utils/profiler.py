@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import logging
+import inspect
+import threading
+from collections import Counter
+from functools import wraps
+from .instance import instance_name
+
+_log = logging.getLogger(__name__)
+
+# Profiler in use, if any
+_active_profiler = None
+
+
+def active_profiler():
+    return _active_profiler
+
+
+class _TimedLock:
+    # Lock proxy that records how long each thread waits to acquire it
+    def __init__(self, lock, profiler, name):
+        self._lock = lock
+        self._profiler = profiler
+        self._name = name
+
+    def acquire(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = self._lock.acquire(*args, **kwargs)
+        self._profiler.record(
+            f"{self._name}[{threading.current_thread().name}]",
+            time.perf_counter() - start,
+        )
+        return result
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class Profiler:
+    # Per-stage timers for the real time path, and an optional sampling profiler.
+    # Stages are timed by temporarily replacing methods with timed wrappers, so
+    # nothing is added to the hot path unless profiling is enabled.
+    def __init__(self, sample_rate=0, thread_prefix="dawcord-"):
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self._patches = []
+        self._sample_interval = 1 / sample_rate if sample_rate else None
+        self._thread_prefix = thread_prefix
+        self._stacks = Counter()
+        self._sampler = None
+        self._sampler_stop = threading.Event()
+        self._start_time = None
+        self._duration = 0.0
+
+    def record(self, name, elapsed):
+        with self._stats_lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                self._stats[name] = [1, elapsed, elapsed]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]:
+                    stats[2] = elapsed
+
+    def wrap(self, name, func):
+        record = self.record
+        perf_counter = time.perf_counter
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                # Separate stats for each instance running in the process
+                record(instance_name(name), perf_counter() - start)
+
+        return timed
+
+    def patch(self, owner, attr, name):
+        # Replace a function, method or static method of a class with a timed version
+        original = inspect.getattr_static(owner, attr)
+        if isinstance(original, staticmethod):
+            timed = staticmethod(self.wrap(name, original.__func__))
+        else:
+            timed = self.wrap(name, original)
+        self._patches.append((owner, attr, original))
+        setattr(owner, attr, timed)
+
+    def instrument_lock(self, obj, attr, name):
+        lock = getattr(obj, attr)
+        if isinstance(lock, _TimedLock):
+            return
+        self._patches.append((obj, attr, lock))
+        setattr(obj, attr, _TimedLock(lock, self, name))
+
+    def start(self):
+        global _active_profiler
+        _active_profiler = self
+        self._start_time = time.perf_counter()
+        if self._sample_interval is not None:
+            self._sampler = threading.Thread(
+                target=self._sample_thread_func, name="profiler-sampler", daemon=True
+            )
+            self._sampler.start()
+
+    def stop(self):
+        global _active_profiler
+        if _active_profiler is self:
+            _active_profiler = None
+        if self._start_time is not None:
+            self._duration = time.perf_counter() - self._start_time
+        if self._sampler is not None:
+            self._sampler_stop.set()
+            self._sampler.join()
+            self._sampler = None
+        # Restore original functions and objects, last patch first
+        for owner, attr, original in reversed(self._patches):
+            setattr(owner, attr, original)
+        self._patches.clear()
+
+    def _sample_thread_func(self):
+        while not self._sampler_stop.wait(self._sample_interval):
+            # PortAudio callbacks run on foreign threads, named "Dummy-N" by python
+            names = {
+                t.ident: t.name
+                for t in threading.enumerate()
+                if t.name.startswith(self._thread_prefix)
+                or isinstance(t, threading._DummyThread)
+            }
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident)
+                if name is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(name)
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def summary(self):
+        lines = [
+            f"{'Stage':<48} {'Calls':>9} {'Total ms':>10} {'Mean us':>9} {'Max us':>9} {'Load %':>7}"
+        ]
+        with self._stats_lock:
+            stats = sorted(self._stats.items(), key=lambda s: s[1][1], reverse=True)
+        for name, (count, total, peak) in stats:
+            load = 100 * total / self._duration if self._duration else 0
+            lines.append(
+                f"{name:<48} {count:>9} {total * 1e3:>10.1f} "
+                f"{total / count * 1e6:>9.1f} {peak * 1e6:>9.1f} {load:>7.2f}"
+            )
+        return "\n".join(lines)
+
+    def write(self, prefix):
+        # Writes a summary table and, if sampling, a flamegraph.pl compatible
+        # collapsed stack file
+        summary = self.summary()
+        _log.info(f"Profile summary ({self._duration:.1f} s):\n{summary}")
+        with open(f"{prefix}.txt", "wt") as f:
+            f.write(summary + "\n")
+        if self._sample_interval is not None:
+            with open(f"{prefix}.folded", "wt") as f:
+                for stack, count in self._stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+
+
+def install_stages(profiler):
+    # Time every stage of the real time path
+    from ..audiosource.reastream.packet import ReaStreamPacket
+    from ..audiosource.reastream.source import ReaStreamAudioSource
+    from ..audiosource.pyaudio.source import PyAudioSource
+    from ..audiosource.mixer.source import MixerAudioSource
+    from ..conversion.resampler import Resampler
+    from ..voice.encoder import Encoder
+
+    profiler.patch(ReaStreamPacket, "parse_packet", "reastream.parse_packet")
+    profiler.patch(ReaStreamAudioSource, "_process_frames", "reastream.process_frames")
+    profiler.patch(ReaStreamAudioSource, "read", "reastream.read")
+    profiler.patch(PyAudioSource, "_receive", "pyaudio.receive")
+    profiler.patch(PyAudioSource, "read", "pyaudio.read")
+    profiler.patch(MixerAudioSource, "read", "mixer.read")
+    profiler.patch(Resampler, "resample", "resampler.resample")
+    profiler.patch(Encoder, "encode", "opus.encode")
+
+
+def instrument_source(profiler, source):
+    # Time lock waits on the buffers of a source (and mixer inputs)
+    for child in getattr(source, "_sources", ()):
+        instrument_source(profiler, child)
+    if hasattr(source, "_buffer_lock"):
+        name = f"{type(source).__name__}.lock_wait"
+        profiler.instrument_lock(source, "_buffer_lock", name)
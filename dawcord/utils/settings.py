@@ -3,18 +3,36 @@
 import json
 from pathlib import Path
 
+# Named latency/efficiency trade-offs. Each one sets the encoder frame length
+# along with the buffer levels of every source, which are counted in frames.
+LATENCY_PROFILES = {
+    # Short frames and a small buffer, for live playing and rehearsals
+    "low-latency": {
+        "encoder": {"frame_length_ms": 10},
+        "source": {"playback_slack_frames": 2, "max_buffer_frames": 5},
+    },
+    # Long frames (less packet overhead) and a deep buffer, for broadcasts
+    "efficient": {
+        "encoder": {"frame_length_ms": 60},
+        "source": {"playback_slack_frames": 2, "max_buffer_frames": 4},
+    },
+}
+
 
 def load_settings(filename):
     # Read settings from json config file
     path = Path(filename)
     settings = dict()
     if path.is_file():
-        return read_json(path)
+        return apply_latency_profile(read_json(path))
 
     # If file does not exist, create it with default values
     settings = {
         "token": "",
+        "channel": None,
         "source": "reastream",
+        "preroll_timeout": 5.0,
+        "latency_profile": None,
         "encoder": {
             "application": "audio",
             "bitrate": 128,
@@ -22,15 +40,41 @@ def load_settings(filename):
             "expected_packet_loss": 0.15,
             "bandwidth": "full",
             "signal_type": "music",
+            "dtx": False,
+            "sample_format": "s16le",
+            "frame_length_ms": 20,
+        },
+        "encoder.adaptive": {
+            "enabled": False,
+            "min_bitrate": 48,
+            "max_bitrate": 128,
+            "min_packet_loss": 0.05,
+            "max_packet_loss": 0.3,
+            "rtt_threshold": 0.25,
+            "lateness_threshold": 0.04,
+            "interval": 2.0,
         },
         "source.reastream": {
             "ip": "127.0.0.1",
             "port": 58710,
+            "multicast_group": None,
+            "interface": None,
+            "reuse_port": False,
             "identifier": "default",
+            "sender_timeout": 1.0,
             "timeout": 2.0,
             "resample_quality": "VHQ",
+            "resample_cpu_budget": 0.1,
+            "resample_cpu_limit": 0.5,
+            "format_crossfade": 0.005,
             "max_buffer_frames": 8,
             "playback_slack_frames": 2,
+            "adaptive_slack": False,
+            "slack_percentile": 95.0,
+            "slack_window": 250,
+            "silence_detection": False,
+            "silence_threshold_db": -80,
+            "silence_hold": 0.5,
             "gain": -3,
         },
         "source.pyaudio": {
@@ -38,13 +82,49 @@ def load_settings(filename):
             "timeout": 2.0,
             "max_buffer_frames": 8,
             "playback_slack_frames": 2,
+            "adaptive_slack": False,
+            "slack_percentile": 95.0,
+            "slack_window": 250,
+            "silence_detection": False,
+            "silence_threshold_db": -80,
+            "silence_hold": 0.5,
+            "gain": 0,
+        },
+        "source.mixer": {
+            "inputs": [
+                {"source": "reastream", "name": "daw", "mix_gain": 0},
+                {
+                    "source": "reastream",
+                    "name": "talkback",
+                    "identifier": "talkback",
+                    "mix_gain": 0,
+                },
+            ],
             "gain": 0,
+            "stats_interval": 10.0,
         },
     }
     write_json(path, settings)
     return None
 
 
+def apply_latency_profile(settings):
+    # Replace encoder and source settings with the ones of the selected profile
+    name = settings.get("latency_profile")
+    if not name:
+        return settings
+    profile = LATENCY_PROFILES.get(name)
+    if profile is None:
+        raise ValueError(
+            f'Unknown latency profile "{name}", must be one of {list(LATENCY_PROFILES)}'
+        )
+    settings.setdefault("encoder", {}).update(profile["encoder"])
+    for section in ("source.reastream", "source.pyaudio"):
+        if section in settings:
+            settings[section].update(profile["source"])
+    return settings
+
+
 def read_json(file):
     with open(file, "rt") as f:
         return json.load(f)
@@ -0,0 +1,4 @@
+from .encoder import *
+from .player import *
+from .controller import *
+from .sink import *
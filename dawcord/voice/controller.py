@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from math import isfinite
+
+_log = logging.getLogger(__name__)
+
+
+class BitrateController:
+    # Adjusts encoder bitrate, FEC and expected packet loss from voice connection
+    # statistics. discord.py does not expose RTCP receiver reports, so packet loss
+    # can't be measured directly. Instead, voice websocket round trip time and
+    # player send lateness are used as congestion signals.
+    def __init__(
+        self,
+        voiceclient,
+        encoder,
+        player,
+        min_bitrate=48,
+        max_bitrate=128,
+        bitrate_step=16,
+        decrease_factor=0.75,
+        fec=True,
+        min_packet_loss=0.05,
+        max_packet_loss=0.3,
+        packet_loss_step=0.05,
+        rtt_threshold=0.25,
+        lateness_threshold=0.04,
+        recover_intervals=3,
+        interval=2.0,
+    ):
+        self._voiceclient = voiceclient
+        self._encoder = encoder
+        self._player = player
+        self._min_bitrate = int(min_bitrate)
+        self._max_bitrate = max(int(max_bitrate), self._min_bitrate)
+        self._bitrate_step = int(bitrate_step)
+        self._decrease_factor = decrease_factor
+        self._fec = fec
+        self._min_packet_loss = min_packet_loss
+        self._max_packet_loss = max(max_packet_loss, min_packet_loss)
+        self._packet_loss_step = packet_loss_step
+        self._rtt_threshold = rtt_threshold
+        self._lateness_threshold = lateness_threshold
+        self._recover_intervals = int(recover_intervals)
+        self._interval = interval
+        self._bitrate = min(max(encoder.bitrate, self._min_bitrate), self._max_bitrate)
+        self._packet_loss = min(
+            max(encoder.expected_packet_loss, self._min_packet_loss),
+            self._max_packet_loss,
+        )
+        self._initial_packet_loss = self._packet_loss
+        self._good_intervals = 0
+        self._last_ack = None
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        self._apply()
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                self._update()
+            except Exception as e:
+                _log.error(f"Bitrate controller error: {str(e)}")
+
+    def _new_rtt(self):
+        # The round trip time is only measured on voice heartbeat ACKs (every
+        # ~14 s), much less often than updates run. Tell if there is a new
+        # sample since the last update, so a slow one only counts once.
+        ws = self._voiceclient._connection.ws
+        keep_alive = getattr(ws, "_keep_alive", None) if ws else None
+        last_ack = getattr(keep_alive, "_last_ack", None)
+        if last_ack is None:
+            # Can't tell, take every sample as new
+            return True
+        new = last_ack != self._last_ack
+        self._last_ack = last_ack
+        return new
+
+    def _congested(self, rtt, average_rtt, lateness, new_rtt):
+        if not isfinite(rtt):
+            return False
+        if new_rtt:
+            if rtt > self._rtt_threshold:
+                return True
+            # Sudden round trip time increase over the running average
+            if isfinite(average_rtt) and rtt > 2 * average_rtt + 0.05:
+                return True
+        return lateness > self._lateness_threshold
+
+    def _update(self):
+        new_rtt = self._new_rtt()
+        rtt = self._voiceclient.latency
+        average_rtt = self._voiceclient.average_latency
+        lateness = self._player.pop_lateness()
+        bitrate = self._bitrate
+        packet_loss = self._packet_loss
+
+        if self._congested(rtt, average_rtt, lateness, new_rtt):
+            # Back off quickly and protect the stream with more redundancy
+            self._good_intervals = 0
+            bitrate = max(self._min_bitrate, int(bitrate * self._decrease_factor))
+            packet_loss = min(
+                self._max_packet_loss, round(packet_loss + self._packet_loss_step, 2)
+            )
+        else:
+            # Recover slowly after several stable intervals
+            self._good_intervals += 1
+            if self._good_intervals < self._recover_intervals:
+                return
+            self._good_intervals = 0
+            bitrate = min(self._max_bitrate, bitrate + self._bitrate_step)
+            packet_loss = max(
+                self._min_packet_loss, round(packet_loss - self._packet_loss_step, 2)
+            )
+
+        if bitrate == self._bitrate and packet_loss == self._packet_loss:
+            return
+
+        _log.info(
+            f"Encoder update: {self._bitrate} -> {bitrate} kbps, "
+            f"expected loss {self._packet_loss:.2f} -> {packet_loss:.2f} "
+            f"(RTT {rtt * 1000:.0f} ms, avg {average_rtt * 1000:.0f} ms, "
+            f"send lateness {lateness * 1000:.1f} ms)"
+        )
+        self._bitrate = bitrate
+        self._packet_loss = packet_loss
+        self._apply()
+
+    def _apply(self):
+        # With FEC disabled in the configuration, it's only turned on while
+        # congestion has raised the expected packet loss over its initial value
+        fec = self._fec or self._packet_loss > self._initial_packet_loss
+        self._encoder.update(
+            bitrate=self._bitrate, fec=fec, expected_packet_loss=self._packet_loss
+        )
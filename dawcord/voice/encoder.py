@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import ctypes
+import discord
+from threading import Lock
+from ..conversion.converter import SAMPLE_FORMATS
+
+# libopus request to enable discontinuous transmission
+CTL_SET_DTX = 4016
+
+# Frame lengths (ms) supported by Opus that the player can send
+FRAME_LENGTHS = (10, 20, 40, 60)
+
+
+class Encoder(discord.opus.Encoder):
+    def __init__(
+        self,
+        application="audio",
+        bitrate=128,
+        fec=True,
+        expected_packet_loss=0.15,
+        bandwidth="full",
+        signal_type="auto",
+        dtx=False,
+        sample_format="s16le",
+        frame_length=20,
+    ):
+        if sample_format not in SAMPLE_FORMATS:
+            raise ValueError(f'Unknown sample format "{sample_format}"')
+        if frame_length not in FRAME_LENGTHS:
+            raise ValueError(
+                f"Unsupported frame length {frame_length} ms, must be one of {FRAME_LENGTHS}"
+            )
+        super().__init__(
+            application=application,
+            bitrate=bitrate,
+            fec=fec,
+            expected_packet_loss=expected_packet_loss,
+            bandwidth=bandwidth,
+            signal_type=signal_type,
+        )
+        self.bitrate = bitrate
+        self.fec = fec
+        self.expected_packet_loss = expected_packet_loss
+        self.set_dtx(dtx)
+        # Frame length and sample format may differ from the 20 ms 16-bit
+        # frames discord.py expects, so frame sizes are set per instance
+        self.sample_format = sample_format
+        self.FRAME_LENGTH = frame_length
+        self.SAMPLES_PER_FRAME = int(self.SAMPLING_RATE / 1000 * frame_length)
+        self.SAMPLE_SIZE = SAMPLE_FORMATS[sample_format] * self.CHANNELS
+        self.FRAME_SIZE = self.SAMPLES_PER_FRAME * self.SAMPLE_SIZE
+        self._pending = {}
+        self._pending_lock = Lock()
+
+    def set_dtx(self, enabled=True):
+        # With DTX, libopus encodes silence as tiny packets at a reduced rate
+        discord.opus._lib.opus_encoder_ctl(
+            self._state, CTL_SET_DTX, 1 if enabled else 0
+        )
+
+    def warmup(self):
+        # Encode a frame of silence, so the first real frame doesn't pay for
+        # any first-call setup
+        self.encode(bytes(self.FRAME_SIZE), self.SAMPLES_PER_FRAME)
+
+    def update(self, bitrate=None, fec=None, expected_packet_loss=None):
+        # Settings are changed from other threads (event loop), but libopus
+        # state is not thread safe. Queue them to be applied by the player
+        # thread right before encoding the next frame.
+        with self._pending_lock:
+            if bitrate is not None:
+                self._pending["bitrate"] = bitrate
+            if fec is not None:
+                self._pending["fec"] = fec
+            if expected_packet_loss is not None:
+                self._pending["expected_packet_loss"] = expected_packet_loss
+
+    def _apply_pending(self):
+        with self._pending_lock:
+            pending = self._pending
+            self._pending = {}
+        if "bitrate" in pending:
+            self.bitrate = self.set_bitrate(pending["bitrate"])
+        if "fec" in pending:
+            self.fec = pending["fec"]
+            self.set_fec(self.fec)
+        if "expected_packet_loss" in pending:
+            self.expected_packet_loss = pending["expected_packet_loss"]
+            self.set_expected_packet_loss_percent(self.expected_packet_loss)
+
+    def encode(self, pcm, frame_size):
+        if self._pending:
+            self._apply_pending()
+        if self.sample_format != "float":
+            return super().encode(pcm, frame_size)
+        # Same as discord.py's encode(), but passing 32-bit float PCM to libopus.
+        # Errors are raised as OpusError by the library bindings.
+        max_data_bytes = len(pcm)
+        pcm_ptr = ctypes.cast(pcm, discord.opus.c_float_ptr)
+        data = (ctypes.c_char * max_data_bytes)()
+        ret = discord.opus._lib.opus_encode_float(
+            self._state, pcm_ptr, frame_size, data, max_data_bytes
+        )
+        return data.raw[:ret]
+
+
+def create_encoder(encoder_config):
+    # Build an encoder from the "encoder" section of the configuration file
+    return Encoder(
+        application=encoder_config["application"],
+        bitrate=encoder_config["bitrate"],
+        fec=encoder_config["fec"],
+        expected_packet_loss=encoder_config["expected_packet_loss"],
+        bandwidth=encoder_config["bandwidth"],
+        signal_type=encoder_config["signal_type"],
+        dtx=encoder_config.get("dtx", False),
+        sample_format=encoder_config.get("sample_format", "s16le"),
+        frame_length=encoder_config.get("frame_length_ms", 20),
+    )
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import discord
+import time
+import logging
+import contextvars
+from discord.enums import SpeakingState
+from ..utils.instance import instance_name
+
+_log = logging.getLogger(__name__)
+
+
+class AudioPlayer(discord.player.AudioPlayer):
+    # Same as discord.py's player, but keeps track of how late each frame is sent,
+    # and sends frames of any length (discord.py's are always 20 ms)
+    def __init__(self, source, client, *, after=None, started=None, frame_length=20):
+        super().__init__(source, client, after=after)
+        self.name = instance_name("dawcord-player")
+        # Run in the context of the creator, to keep its instance log tags
+        self._context = contextvars.copy_context()
+        self.DELAY = frame_length / 1000.0
+        self._samples_per_frame = int(
+            discord.opus.Encoder.SAMPLING_RATE / 1000 * frame_length
+        )
+        self._lateness = 0.0
+        # Reference time to report how long it took to send audio
+        self._started = started
+
+    def run(self):
+        self._context.run(super().run)
+
+    def pop_lateness(self):
+        # Returns the worst send lateness (seconds) since the last call
+        lateness = self._lateness
+        self._lateness = 0.0
+        return lateness
+
+    def _do_run(self):
+        self.loops = 0
+        self._start = time.perf_counter()
+
+        # getattr lookup speed ups
+        client = self.client
+        play_audio = client.send_audio_packet
+        is_silent = getattr(self.source, "is_silent", None)
+        speaking = True
+        self._speak(SpeakingState.voice)
+
+        while not self._end.is_set():
+            # are we paused?
+            if not self._resumed.is_set():
+                self.send_silence()
+                # wait until we aren't
+                self._resumed.wait()
+                continue
+
+            data = self.source.read()
+
+            if not data:
+                self.stop()
+                break
+
+            # are we disconnected from voice?
+            if not client.is_connected():
+                _log.debug(f"Not connected, waiting for {client.timeout}s...")
+                # wait until we are connected, but not forever
+                connected = client.wait_until_connected(client.timeout)
+                if self._end.is_set() or not connected:
+                    _log.debug("Aborting playback")
+                    return
+                _log.debug("Reconnected, resuming playback")
+                self._speak(SpeakingState.voice)
+                # reset our internal data
+                self.loops = 0
+                self._start = time.perf_counter()
+
+            # How far behind schedule this frame is being sent. The sleep below
+            # targets one extra frame delay after the first one.
+            scheduled = self._start + self.DELAY * (self.loops + 1 if self.loops else 0)
+            lateness = time.perf_counter() - scheduled
+            if lateness > self._lateness:
+                self._lateness = lateness
+
+            if is_silent is not None and is_silent():
+                # Input is silent: stop speaking and skip encoding and sending
+                # frames, but keep the RTP timestamp running
+                if speaking:
+                    self.send_silence()
+                    self._speak(SpeakingState.none)
+                    speaking = False
+                client.checked_add("timestamp", self._samples_per_frame, 4294967295)
+            else:
+                if not speaking:
+                    self._speak(SpeakingState.voice)
+                    speaking = True
+                # discord.py advances the RTP timestamp by 20 ms per packet,
+                # advance it by the actual frame length instead
+                timestamp = client.timestamp
+                play_audio(data, encode=not self.source.is_opus())
+                client.timestamp = timestamp
+                client.checked_add("timestamp", self._samples_per_frame, 4294967295)
+                if self._started is not None and data != bytes(len(data)):
+                    _log.info(
+                        f"First audible frame sent after {(time.perf_counter() - self._started) * 1000:.0f} ms"
+                    )
+                    self._started = None
+            self.loops += 1
+            next_time = self._start + self.DELAY * self.loops
+            delay = max(0, self.DELAY + (next_time - time.perf_counter()))
+            time.sleep(delay)
+
+        if client.is_connected():
+            self.send_silence()
+
+
+def play(voiceclient, source, encoder, after=None, started=None):
+    # Equivalent to VoiceClient.play(), but using our own encoder and player
+    if not voiceclient.is_connected():
+        raise discord.ClientException("Not connected to voice.")
+
+    if voiceclient.is_playing():
+        raise discord.ClientException("Already playing audio.")
+
+    if not source.is_opus():
+        voiceclient.encoder = encoder
+
+    player = AudioPlayer(
+        source,
+        voiceclient,
+        after=after,
+        started=started,
+        frame_length=encoder.FRAME_LENGTH,
+    )
+    voiceclient._player = player
+    player.start()
+    return player
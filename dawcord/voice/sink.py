@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import time
+import struct
+import logging
+from threading import Event
+
+_log = logging.getLogger(__name__)
+
+
+class HeadlessSink:
+    # Stand-in for a voice connection. Reads and encodes frames from a source
+    # with the same cadence as the player, and discards them or writes them to
+    # a file (raw PCM, or Opus packets prefixed by their 16-bit length).
+    # The source is not cleaned up, it stays owned by the caller.
+    def __init__(self, source, encoder, output=None, output_format="pcm", started=None):
+        if output_format not in ("pcm", "opus"):
+            raise ValueError(f'Unknown headless output format "{output_format}"')
+        self._source = source
+        self._encoder = encoder
+        self._output = output
+        self._output_format = output_format
+        self._stop = Event()
+        self._started = started
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, duration=None):
+        is_silent = getattr(self._source, "is_silent", None)
+        delay = self._encoder.FRAME_LENGTH / 1000.0
+        frames = 0
+        silent_frames = 0
+        read_time = 0.0
+        read_max = 0.0
+        encode_time = 0.0
+        encode_max = 0.0
+        lateness_max = 0.0
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        loops = 0
+        output = None
+        try:
+            if self._output is not None:
+                output = open(self._output, "wb")
+            while not self._stop.is_set():
+                if duration and time.perf_counter() - start >= duration:
+                    break
+
+                # Same schedule as the player, see AudioPlayer._do_run()
+                scheduled = start + delay * (loops + 1 if loops else 0)
+                lateness_max = max(lateness_max, time.perf_counter() - scheduled)
+
+                t0 = time.perf_counter()
+                data = self._source.read()
+                t1 = time.perf_counter()
+                if not data:
+                    break
+                read_time += t1 - t0
+                read_max = max(read_max, t1 - t0)
+
+                if is_silent is not None and is_silent():
+                    # Nothing would be sent, but keep the PCM output in time
+                    silent_frames += 1
+                    if output is not None and self._output_format == "pcm":
+                        output.write(data)
+                else:
+                    packet = self._encoder.encode(data, self._encoder.SAMPLES_PER_FRAME)
+                    t2 = time.perf_counter()
+                    encode_time += t2 - t1
+                    encode_max = max(encode_max, t2 - t1)
+                    frames += 1
+                    if self._started is not None and data != bytes(len(data)):
+                        _log.info(
+                            f"First audible frame after {(time.perf_counter() - self._started) * 1000:.0f} ms"
+                        )
+                        self._started = None
+                    if output is not None:
+                        if self._output_format == "pcm":
+                            output.write(data)
+                        else:
+                            output.write(struct.pack("<H", len(packet)))
+                            output.write(packet)
+
+                loops += 1
+                next_time = start + delay * loops
+                time.sleep(max(0, delay + (next_time - time.perf_counter())))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpu_start
+            if output is not None:
+                output.close()
+
+        loops = max(loops, 1)
+        _log.info(
+            f"Headless run: {elapsed:.1f} s, {frames} frames encoded, {silent_frames} silent. "
+            f"Read {read_time / loops * 1e3:.3f} ms avg, {read_max * 1e3:.3f} ms max. "
+            f"Encode {encode_time / max(frames, 1) * 1e3:.3f} ms avg, {encode_max * 1e3:.3f} ms max. "
+            f"Max send lateness {lateness_max * 1e3:.1f} ms. "
+            f"Process CPU {100 * cpu / max(elapsed, 1e-9):.1f}%"
+        )
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from dawcord.audiosource.reastream.source import ReaStreamAudioSource
+
+
+def planar_frames(channels, count=441):
+    # ReaStream packet payload: non-interleaved 32-bit float samples
+    samples = np.sin(np.arange(count) * 0.05).astype("<f4") * 0.5
+    return np.tile(samples, channels).tobytes()
+
+
+def test_channel_changes_keep_resampling():
+    # 2ch -> 1ch -> 3ch at 44.1 kHz: the last change needs the same (mono)
+    # resampler as the one before, which must keep working
+    source = ReaStreamAudioSource(port=0, resample_quality="HQ")
+    try:
+        output = bytearray()
+        for channels in (2, 1, 3):
+            source._on_format_change(44100, channels)
+            for _ in range(4):
+                output += source._process_frames(planar_frames(channels), channels)
+        assert len(output) > 0
+    finally:
+        source.cleanup()
+
+
+def test_format_changes_are_crossfaded():
+    # The end of the previous format is faded out over the new one, also when
+    # it wasn't resampled (48 kHz), so a continuous sine has no jumps
+    source = ReaStreamAudioSource(port=0, resample_quality="HQ")
+    try:
+        output = bytearray()
+        position = 0.0
+        for rate in (48000, 44100, 48000):
+            source._on_format_change(rate, 2)
+            for _ in range(40):
+                t = position + np.arange(128) / rate
+                position += 128 / rate
+                samples = (0.5 * np.sin(2 * np.pi * 440 * t)).astype("<f4")
+                output += source._process_frames(np.tile(samples, 2).tobytes(), 2)
+        left = np.frombuffer(bytes(output), dtype="<i2")[::2].astype(int)
+        # A 440 Hz sine at half scale moves up to ~950 per sample at 48 kHz
+        assert np.abs(np.diff(left)).max() < 1200
+    finally:
+        source.cleanup()
+
+
+def test_resume_after_underrun_fades_in():
+    # Samples held back before an underrun must not be played right before
+    # the resumed audio, which starts from silence instead of jumping
+    source = ReaStreamAudioSource(port=0)
+    try:
+        source._on_format_change(48000, 2)
+        loud = (np.ones(1920, dtype="<f4") * 0.5).tobytes()
+        for _ in range(4):
+            source._buffer_frames(loud)
+        while any(source.read()):
+            pass
+        output = bytearray()
+        for _ in range(4):
+            source._buffer_frames(bytes(np.negative(np.frombuffer(loud, "<f4"))))
+            output += source.read()
+        left = np.frombuffer(bytes(output), dtype="<i2")[::2].astype(int)
+        assert left.max() <= 0
+        assert np.abs(np.diff(left)).max() < 1000
+    finally:
+        source.cleanup()